@@ -0,0 +1,344 @@
+"""Command line entry point to run the full clip pipeline without Jupyter.
+
+Run it with ``python -m component.cli`` from the root of the repository (the application
+is not an installable package). The tiles and maps of the application are never imported
+and the pipeline modules (which initialize Earth Engine) are only imported once the
+arguments are parsed so that ``--help`` answers instantly. sepal_ui is still needed by
+the pipeline and imports ipyvuetify and ipywidgets.
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, get_args
+
+from component.typings.custom_types import AdjustmentType
+
+
+class TextProgress:
+    """Plain text progress reporter with the same interface as the CustomAlert widget."""
+
+    def __init__(self, stream=sys.stdout, interval: float = 5):
+        """
+        Args:
+            stream: the stream to write the progress to
+            interval: the minimum number of seconds between 2 progress lines
+        """
+        self.stream = stream
+        self.interval = interval
+        self.total_image = 0
+        self.progress_text = ""
+        self.current_progress = 0
+        self.last_report = 0.0
+        self.lock = threading.Lock()
+
+    def _write(self, msg: str) -> None:
+        with self.lock:
+            print(msg, file=self.stream, flush=True)
+
+    def add_msg(self, msg: str, type_: str = "info") -> None:
+        self._write(f"[{type_}] {msg}")
+
+    def add_live_msg(self, msg: str, type_: str = "info") -> None:
+        self.add_msg(msg, type_)
+
+    def reset_progress(self, total_image: int = 1, progress_text: str = "") -> None:
+        self.total_image = total_image
+        self.progress_text = progress_text
+        self.current_progress = 0
+        self.last_report = 0.0
+        self._write(f"{progress_text} 0/{total_image}")
+
+    def update_progress(self) -> None:
+        self.current_progress += 1
+
+        # only report from time to time to keep the logs readable
+        now = time.monotonic()
+        done = self.current_progress >= self.total_image
+        if done or now - self.last_report >= self.interval:
+            self.last_report = now
+            self._write(
+                f"{self.progress_text} {self.current_progress}/{self.total_image}"
+            )
+
+
+def get_parser() -> argparse.ArgumentParser:
+    """Create the parser of the command line arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="python -m component.cli",
+        description="Export a pdf of clipped time series around points or shapes.",
+    )
+    parser.add_argument(
+        "input", type=Path, help="points table (.csv, .txt) or vector file"
+    )
+    parser.add_argument("--driver", choices=["gee", "planet"], default="gee")
+    parser.add_argument(
+        "--mosaics",
+        nargs="+",
+        required=True,
+        help="years for the gee driver, mosaic names for the planet driver",
+    )
+    parser.add_argument(
+        "--bands", required=True, help='band combination, e.g. "Red, Green, Blue"'
+    )
+    parser.add_argument(
+        "--sources",
+        nargs="+",
+        choices=["landsat", "sentinel"],
+        default=["landsat", "sentinel"],
+        help="satellites used by the gee driver",
+    )
+    parser.add_argument(
+        "--image-size", type=int, default=2000, help="size of the thumbnails in meters"
+    )
+    parser.add_argument(
+        "--square-size", type=int, default=30, help="size of the squares in meters"
+    )
+    parser.add_argument(
+        "--enhance-method", choices=get_args(AdjustmentType), default="min_max"
+    )
+    parser.add_argument(
+        "--stretch",
+        choices=["image", "point", "campaign"],
+        default="image",
+        help="share the stretch statistics between the years of a point or all the points",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["pdf", "png", "webp", "cog"],
+        default="pdf",
+        help="a pdf document or a folder with one file per point",
+    )
+    parser.add_argument(
+        "--no-native-crs",
+        dest="native_crs",
+        action="store_false",
+        help="download the images in EPSG:4326 instead of the display projection",
+    )
+    parser.add_argument(
+        "--dpi", type=int, default=200, help="resolution of the rendered pages"
+    )
+    parser.add_argument("--id-column", default="id")
+    parser.add_argument("--lat-column", default="lat")
+    parser.add_argument("--lng-column", default="lng")
+    parser.add_argument(
+        "--planet-key",
+        default=os.getenv("PLANET_API_KEY"),
+        help="Planet API key, default to the PLANET_API_KEY environment variable",
+    )
+    parser.add_argument(
+        "--overwrite", action="store_true", help="overwrite an existing pdf"
+    )
+
+    return parser
+
+
+def check_args(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    """Validate the arguments that argparse cannot check alone (exit with code 2 if invalid)."""
+    from component import parameter as cp
+
+    if not args.input.is_file():
+        parser.error(f"the file {args.input} does not exist")
+
+    if not cp.min_image <= args.image_size <= cp.max_image:
+        parser.error(f"--image-size must be in [{cp.min_image}, {cp.max_image}]")
+
+    if not cp.min_square <= args.square_size <= cp.max_square:
+        parser.error(f"--square-size must be in [{cp.min_square}, {cp.max_square}]")
+
+    if args.dpi <= 0:
+        parser.error("--dpi must be a positive integer")
+
+    if args.driver == "gee":
+        if args.bands not in cp.getAvailableBands():
+            parser.error(f"--bands must be one of {list(cp.getAvailableBands())}")
+        try:
+            args.mosaics = [int(m) for m in args.mosaics]
+        except ValueError:
+            parser.error("--mosaics must be years when using the gee driver")
+
+    elif args.driver == "planet":
+        if args.bands not in cp.planet_bands_combo:
+            parser.error(f"--bands must be one of {list(cp.planet_bands_combo)}")
+        if not args.planet_key:
+            parser.error("--planet-key is required when using the planet driver")
+        args.sources = []
+
+
+def read_geometry(args: argparse.Namespace):
+    """Read the input file as a GeoDataFrame with an ``id`` column, the same way as the FileTile."""
+
+    import geopandas as gpd
+    import pandas as pd
+
+    if args.input.suffix.lower() in [".csv", ".txt"]:
+        df = pd.read_csv(args.input, sep=None, engine="python")
+        df = df.filter(items=[args.lat_column, args.lng_column, args.id_column])
+        df = df.rename(
+            columns={
+                args.lat_column: "lat",
+                args.lng_column: "lng",
+                args.id_column: "id",
+            }
+        )
+        gdf = gpd.GeoDataFrame(
+            df, geometry=gpd.points_from_xy(df.lng, df.lat), crs="EPSG:4326"
+        )
+
+    else:
+        gdf = gpd.read_file(args.input).to_crs(4326)
+        gdf = gdf.filter([args.id_column, "geometry"])
+        gdf = gdf.rename(columns={args.id_column: "id"})
+
+    if gdf.id.duplicated().any():
+        raise ValueError(f"The column {args.id_column} contains duplicated values")
+
+    return gdf
+
+
+def run(args: argparse.Namespace, output: TextProgress) -> Path:
+    """Run the full pipeline and return the path to the pdf file or the images folder."""
+
+    # heavy imports are only done once the arguments are valid
+    from component import scripts as cs
+    from component.scripts.manifest import JobManifest, get_job_dir
+    from component.scripts.utils import get_output_path, remove_tmp_dir
+
+    geometry = read_geometry(args)
+
+    output_path = get_output_path(
+        args.input.stem,
+        args.sources,
+        args.bands,
+        args.image_size,
+        args.enhance_method,
+        args.format,
+    )
+    if output_path.exists() and not args.overwrite:
+        output.add_msg(f"Output already exist: {output_path}", "success")
+        return output_path
+
+    # use the same job folder as the application to resume interrupted exports
+    job_params = {
+        "file": str(args.input),
+        "driver": args.driver,
+        "geometry": geometry.to_json(),
+        "bands": args.bands,
+        "sources": args.sources,
+        "square_size": args.square_size,
+        "image_size": args.image_size,
+        "mosaics": args.mosaics,
+        "enhance_method": args.enhance_method,
+        "dpi": args.dpi,
+        "output_format": args.format,
+        "native_crs": args.native_crs,
+        "stretch_mode": args.stretch,
+    }
+    tmp_dir = get_job_dir(job_params)
+    manifest = JobManifest(tmp_dir)
+
+    if manifest.tasks:
+        output.add_msg("Resuming the previous export of these points")
+
+    if args.driver == "planet":
+        from sepal_ui.planetapi import PlanetModel
+
+        vrt_list, title_list = cs.get_planet_vrt(
+            geometry,
+            args.mosaics,
+            args.image_size,
+            args.input.stem,
+            args.bands,
+            output,
+            tmp_dir,
+            PlanetModel(args.planet_key),
+            manifest,
+            args.native_crs,
+        )
+
+    else:
+        vrt_list, title_list = cs.get_gee_vrt(
+            geometry,
+            args.mosaics,
+            args.image_size,
+            args.input.stem,
+            args.bands,
+            args.sources,
+            output,
+            tmp_dir,
+            manifest,
+            args.native_crs,
+        )
+
+    if args.format != "pdf":
+        output_path = cs.get_images(
+            args.input,
+            args.mosaics,
+            args.image_size,
+            args.square_size,
+            vrt_list,
+            title_list,
+            args.bands,
+            geometry,
+            output,
+            tmp_dir,
+            args.enhance_method,
+            args.sources,
+            manifest,
+            format=args.format,
+            stretch_mode=args.stretch,
+        )
+    else:
+        output_path = cs.get_pdf(
+            args.input,
+            args.mosaics,
+            args.image_size,
+            args.square_size,
+            vrt_list,
+            title_list,
+            args.bands,
+            geometry,
+            output,
+            tmp_dir,
+            args.enhance_method,
+            args.sources,
+            manifest,
+            dpi=args.dpi,
+            stretch_mode=args.stretch,
+        )
+
+    # the job folder is only kept when the export fails, to resume it
+    remove_tmp_dir(tmp_dir)
+
+    return output_path
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the clip pipeline from the command line and return the exit code."""
+
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    check_args(parser, args)
+
+    output = TextProgress()
+
+    try:
+        pdf_file = run(args, output)
+    except KeyboardInterrupt:
+        output.add_msg("Export interrupted, run the same command to resume it", "error")
+        return 130
+    except Exception as e:
+        output.add_msg(f"{type(e).__name__}: {e}", "error")
+        return 1
+
+    print(pdf_file)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,7 @@
 from sepal_ui import model
-from traitlets import Any, Bool, Unicode
+from traitlets import Any, Bool, Int, Unicode
+
+from component import parameter as cp
 
 
 class ExportModel(model.Model):
@@ -7,3 +9,7 @@ class ExportModel(model.Model):
     vue = Any(None).tag(sync=True)
     overwrite = Bool(True).tag(sync=True)
     enhance_method = Unicode("min_max").tag(sync=True)
+    dpi = Int(cp.pdf_dpi).tag(sync=True)
+    output_format = Unicode(next(iter(cp.export_formats))).tag(sync=True)
+    native_crs = Bool(cp.native_crs).tag(sync=True)
+    stretch_mode = Unicode(next(iter(cp.stretch_modes))).tag(sync=True)
@@ -4,6 +4,7 @@ if you only have few widgets, a module is not necessary and you can simply use a
 If you use a module import all the functions here to only have 1 call to make
 """
 from .directory import *
+from .download import *
 from .gee import *
 from .pdf import *
 from .planet import *
@@ -12,3 +12,17 @@ tmp_dir.mkdir(exist_ok=True)
 sepal_down_dir = Path.home() / "downloads"
 
 test_dataset = Path(__file__).parents[2] / "utils" / "clip_test_points.csv"
+
+# persistent cache of the downloaded tiles shared by all the exports
+cache_dir = result_dir / "cache"
+cache_dir.mkdir(exist_ok=True)
+
+cache_max_size = 5 * 1024**3  # in bytes, set to 0 to disable the cache
+
+# persistent cache of the Planet mosaics and quads descriptions
+metadata_dir = result_dir / "metadata"
+metadata_dir.mkdir(exist_ok=True)
+
+# durable folders of the export jobs, kept until the job is completed to resume it
+job_dir = result_dir / "jobs"
+job_dir.mkdir(exist_ok=True)
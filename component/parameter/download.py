@@ -0,0 +1,12 @@
+import os
+
+# number of threads used to download the images
+# downloads are I/O-bound so we can use several threads per CPU
+download_max_workers = min(32, (os.cpu_count() or 1) * 4)
+
+# download the images directly in the display projection (EPSG:3857)
+# so that the thumbnails are read without being resampled a second time
+native_crs = True
+
+# size of the buffer used to stream the downloaded files to the disk (in bytes)
+download_chunk_size = 1024 * 1024
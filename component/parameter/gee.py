@@ -12,6 +12,19 @@ gee_min_sentinel_year = 2015  # launch of sentinel 2
 gee_max_end_year = datetime.datetime.now().year
 sources = ["landsat", "sentinel"]
 
+# number of buffers sent in a single server-side satellite selection request
+gee_selection_chunk_size = 250
+
+# concurrency and rate limits of the requests sent to Earth Engine
+gee_max_workers = 10
+gee_requests_per_second = 10
+gee_max_retries = 5
+gee_backoff_factor = 1  # in seconds, doubled after each retry
+
+# close buffers using the same satellite are downloaded in a single shared region
+gee_cluster_max_pixels = 1024  # maximum side of a shared region in pixels
+gee_cluster_max_area_ratio = 1  # maximum ratio between a region and its buffers areas
+
 
 # functions to access parameters according to the used satellite
 def getSatellites(sources, year):
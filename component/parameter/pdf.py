@@ -1,5 +1,57 @@
+import os
 from itertools import product
 
+# number of processes used to render the pdf pages, set to 1 to render in the main process
+# rendering is CPU-bound but the kernel, the downloads and GDAL need some CPUs too so
+# only half of them are used (at most 4)
+pdf_max_workers = max(1, min(4, (os.cpu_count() or 1) // 2))
+
+# maximum number of raster datasets kept open by each thread while rendering
+dataset_pool_size = 32
+
+# the GDAL block cache of each process is sized to hold the blocks read for
+# gdal_cache_factor points in every image, within [gdal_cache_min, RAM * gdal_cache_ram_ratio / workers]
+gdal_cache_factor = 4
+gdal_cache_min = 64 * 1024**2
+gdal_cache_ram_ratio = 0.25
+
+# number of pages streamed in a single pdf part before it is closed
+# each part is a checkpoint to resume an interrupted export and the unit of work of
+# the render processes
+pdf_pages_per_part = 50
+
+# maximum number of pdf parts, larger exports use larger parts so that the final merge
+# (which parses every part) only opens a bounded number of files
+pdf_max_parts = 16
+
+# resolution of the rendered pages (dots per inch)
+# the thumbnails are embedded at their native resolution, the dpi only applies to the rasterized parts of the page
+pdf_dpis = [150, 200, 300, 500]
+pdf_dpi = 200
+
+# the output formats of the export, pdf is a single document while the others
+# write one file per point in a folder
+export_formats = {
+    "pdf": "PDF document",
+    "png": "PNG contact sheets",
+    "webp": "WebP contact sheets",
+    "cog": "Cloud Optimized GeoTIFF stacks",
+}
+
+# minimum size of the thumbnails in the contact sheets (in pixels)
+sheet_min_cell = 256
+
+# options of the contact sheet encoders
+sheet_options = {"png": {"optimize": False}, "webp": {"quality": 90, "method": 4}}
+
+# creation options of the COG stacks, overviews are built automatically by the driver
+cog_options = {
+    "blocksize": 256,
+    "compress": "DEFLATE",
+    "predictor": 3,
+    "overview_resampling": "average",
+}
+
 
 def get_dims(N):
     """
@@ -14,4 +14,30 @@ planet_date_ranges = {
 
 planet_bands_combo = {"rgb": [1, 2, 3], "cir": [4, 1, 2]}
 
+# the name of the bands of the Planet quads
+planet_band_names = {1: "Red", 2: "Green", 3: "Blue", 4: "NIR"}
+
 planet_semesters = {"S1": "Semester 1", "S2": "Semester 2"}
+
+# number of concurrent requests sent to the Planet API to describe the quads
+planet_max_workers = 8
+
+# retries of the Planet API requests failing with a rate limit or a server error
+planet_max_retries = 5
+planet_backoff_factor = 1  # in seconds, doubled after each retry
+planet_timeout = 60  # in seconds
+
+# only keep the part of the quads covered by the buffers
+planet_crop_quads = True
+
+# creation options of the processed quads
+planet_gtiff_options = {
+    "tiled": True,
+    "blockxsize": 256,
+    "blockysize": 256,
+    "compress": "deflate",
+    "predictor": 2,
+}
+
+# number of seconds the descriptions of the mosaics and quads are kept in the cache
+planet_cache_ttl = 24 * 3600
@@ -12,6 +12,9 @@ max_image = 10000
 min_square = 10
 max_square = 500
 
+# the number of buffer sets (geometry, size) kept in memory by get_buffers
+buffers_cache_size = 8
+
 # the color and size wich will be used for the display of the polygon
 polygon_colors = {
     "Red, Green, Blue": "blue",
@@ -29,3 +32,24 @@ polygon_width = 2
 
 # the basemap used in the file tile
 basemap = "Esri.WorldImagery"
+
+# the adaptive equalization (CLAHE) backend: "opencv", "skimage" or "auto" to use
+# opencv when it is installed
+clahe_backend = "auto"
+
+# the clip limit of the adaptive equalization, normalized between 0 and 1 like in skimage
+clahe_clip_limit = 0.03
+
+# how the stretch statistics are shared between the thumbnails
+# only used by the min_max, standard_deviation, contrast_stretching and percent_clip methods
+stretch_modes = {
+    "image": "Per image",
+    "point": "Shared by all the years of a point",
+    "campaign": "Shared by all the points",
+}
+
+# maximum number of pixels per band kept to estimate the percentiles of a shared stretch
+stretch_sample_size = 100_000
+
+# number of points sampled to compute the campaign stretch
+stretch_sample_points = 50
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+
+from component import parameter as cp
+
+
+def get_cache_key(*parts) -> str:
+    """Hash the parameters identifying a tile (source, date, bands, scale, geometry...)."""
+
+    key = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def get_geometry_hash(geometry: dict, precision: int = 6) -> str:
+    """Hash a GeoJSON geometry with rounded coordinates to be insensitive to float noise."""
+
+    def round_coords(coords):
+        if isinstance(coords, (list, tuple)):
+            return [round_coords(c) for c in coords]
+        return round(coords, precision)
+
+    return get_cache_key(geometry["type"], round_coords(geometry["coordinates"]))
+
+
+class TileCache:
+    """On-disk content-addressed cache of tiles with a LRU eviction policy.
+
+    The tiles are stored as ``<cache_dir>/<key[:2]>/<key>.tif``. Writes are atomic
+    (copy to a temporary file and rename) so concurrent threads or processes never
+    read a partial tile. The modification time of the files is used as the LRU clock.
+    """
+
+    def __init__(
+        self, cache_dir: Path = cp.cache_dir, max_size: int = cp.cache_max_size
+    ):
+        """
+        Args:
+            cache_dir: the folder where the tiles are stored
+            max_size: the maximum size of the cache in bytes, 0 to disable it
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self.size: Optional[int] = None
+        self.lock = threading.Lock()
+
+    def path(self, key: str) -> Path:
+        """Return the path of a tile in the cache."""
+
+        return self.cache_dir / key[:2] / f"{key}.tif"
+
+    def get(self, key: str, dst: Path) -> bool:
+        """Copy the cached tile to dst, return False if the tile is not in the cache."""
+
+        if not self.max_size:
+            return False
+
+        src = self.path(key)
+        if not src.is_file():
+            return False
+
+        try:
+            # refresh the LRU clock
+            os.utime(src)
+
+            # hard link the file when possible to avoid copying it
+            if not dst.is_file():
+                try:
+                    os.link(src, dst)
+                except OSError:
+                    shutil.copyfile(src, dst)
+
+        except FileNotFoundError:
+            return False  # evicted in the meantime
+
+        return True
+
+    def put(self, key: str, src: Path) -> None:
+        """Add a tile to the cache and evict the least recently used ones if needed."""
+
+        if not self.max_size:
+            return
+
+        dst = self.path(key)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+
+        # write atomically in the cache folder
+        fd, tmp = tempfile.mkstemp(dir=dst.parent, suffix=".part")
+        os.close(fd)
+        shutil.copyfile(src, tmp)
+
+        with self.lock:
+            # a replaced tile doesn't take more room than the new one
+            old_size = dst.stat().st_size if dst.is_file() else 0
+            os.replace(tmp, dst)
+
+            if self.size is None:
+                self.size = sum(f.stat().st_size for f in self.files())
+            else:
+                self.size += dst.stat().st_size - old_size
+
+            if self.size > self.max_size:
+                self.evict()
+
+    def files(self) -> list:
+        """Return all the tiles of the cache."""
+
+        return list(self.cache_dir.glob("*/*.tif"))
+
+    def evict(self) -> None:
+        """Remove the least recently used tiles until the cache fits in max_size."""
+
+        tiles = []
+        for file in self.files():
+            try:
+                tiles.append((file.stat().st_mtime, file.stat().st_size, file))
+            except FileNotFoundError:
+                continue  # already evicted by another process
+
+        self.size = sum(size for _, size, _ in tiles)
+        for _, size, file in sorted(tiles):
+            if self.size <= self.max_size:
+                break
+
+            file.unlink(missing_ok=True)
+            self.size -= size
+
+
+# the cache shared by all the drivers
+tile_cache = TileCache()
@@ -1,21 +1,52 @@
+import multiprocessing
 import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from math import ceil
 from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
 
 import geopandas as gpd
-import matplotlib.pyplot as plt
 import numpy as np
+from matplotlib import colormaps
 from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+from PIL import Image, ImageDraw, ImageFont
 from pypdf import PdfWriter
+from rasterio import warp
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.io import MemoryFile
+from rasterio.shutil import copy as rio_copy
+from rasterio.transform import from_bounds
 from sepal_ui.scripts.utils import init_ee
 from unidecode import unidecode
 
 from component import parameter as cp
-from component import widget as cw
 
-from .utils import enhance_band, get_buffers, get_pdf_path, remove_tmp_dir, reproject
+from .manifest import PENDING, RENDERED, JobManifest
+from .utils import (
+    STRETCH_METHODS,
+    StretchAccumulator,
+    dataset_pool,
+    enhance_bands,
+    get_buffers,
+    get_gdal_cache_size,
+    get_output_path,
+    get_pdf_path,
+    reproject,
+    set_gdal_cache,
+)
+
+if TYPE_CHECKING:
+    from component import widget as cw
 
 init_ee()
 
+# lookup table used to display the single band thumbnails of the contact sheets
+_viridis = (colormaps["viridis"](np.linspace(0, 1, 256))[:, :3] * 255).astype(np.uint8)
+
 
 def is_pdf(file, bands):
     """check if the pdf is already existing, return false if not."""
@@ -33,6 +64,645 @@ def is_pdf(file, bands):
     return pdf_file.is_file()
 
 
+class PageTemplate:
+    """Figure of a pdf page built once and reused for every point of the export.
+
+    Creating the figure, the axes grid and the constrained layout is a large share of the
+    rendering time of a page. The template builds them once and each page only swaps the
+    image data, the square coordinates and the titles before being saved.
+    """
+
+    def __init__(
+        self, nb_images: int, nb_col: int, nb_line: int, band_combo: str, dpi: int
+    ):
+        """
+        Args:
+            nb_images: the number of thumbnails displayed on the page
+            nb_col: the number of columns of the page
+            nb_line: the number of lines of the page
+            band_combo: the bands displayed in the thumbnails
+            dpi: the resolution of the rendered page
+        """
+        self.fig = Figure(figsize=(11.69, 8.27), dpi=dpi, constrained_layout=True)
+        axes = self.fig.subplots(nb_line, nb_col)
+
+        # I reshape by default to avoid a crash
+        # if nb_line = 1 the dimension of the table is reduced
+        axes = np.array(axes, dtype=object).reshape(nb_line, nb_col)
+
+        self.suptitle = self.fig.suptitle("", fontsize=16, fontweight="bold")
+
+        self.images, self.squares, self.titles = [], [], []
+        for placement_id in range(nb_line * nb_col):
+            place = cp.getPositionPdf(placement_id, nb_col)
+            ax = axes[place[0], place[1]]
+            ax.axis("off")
+            ax.set_aspect("equal", "box")
+
+            # the remaining axes stay as empty placeholders
+            if placement_id >= nb_images:
+                continue
+
+            # "none" embeds the thumbnail at its native resolution in the pdf
+            # instead of resampling it to the page dpi
+            image = ax.imshow(
+                np.zeros((1, 1, 3)), interpolation="none", extent=[0, 1, 0, 1]
+            )
+            (square,) = ax.plot(
+                [],
+                [],
+                color=cp.polygon_colors[band_combo],
+                linewidth=cp.polygon_width,
+            )
+            title = ax.set_title(
+                "",
+                x=0.0,
+                y=1.0,
+                fontsize="small",
+                backgroundcolor="white",
+                ha="left",
+            )
+
+            self.images.append(image)
+            self.squares.append(square)
+            self.titles.append(title)
+
+        self.layout_done = False
+
+    def save(
+        self, pdf: PdfPages, page_title: str, square: tuple, thumbnails: list
+    ) -> None:
+        """Update the template with the data of a point and append it to the pdf.
+
+        Args:
+            pdf: the opened pdf file
+            page_title: the title of the page
+            square: the x and y coordinates of the square drawn around the point
+            thumbnails: the (data, extent, title) of each thumbnail
+        """
+        self.suptitle.set_text(page_title)
+
+        for image, line, title, (data, extent, text) in zip(
+            self.images, self.squares, self.titles, thumbnails
+        ):
+            # single band are displayed with a colormap, multi band as RGB
+            # the enhanced bands are already in [0, 1] so the same scale is used for
+            # every thumbnail
+            if data.ndim == 2:
+                image.set_cmap("viridis")
+                image.set_clim(0, 1)
+
+            xmin, ymin, xmax, ymax = extent
+            image.set_data(data)
+            image.set_extent([xmin, xmax, ymin, ymax])
+            image.axes.set_xlim(xmin, xmax)
+            image.axes.set_ylim(ymin, ymax)
+
+            line.set_data(*square)
+            title.set_text(text)
+
+        pdf.savefig(self.fig)
+
+        # the layout only depends on the grid so it is computed once and then frozen
+        if not self.layout_done:
+            self.fig.set_layout_engine("none")
+            self.layout_done = True
+
+
+# templates of the current process, a worker process builds its own ones
+_templates = {}
+
+
+def get_page_template(
+    nb_images: int, nb_col: int, nb_line: int, band_combo: str, dpi: int
+) -> PageTemplate:
+    """Return the page template of the current process for this layout."""
+    key = (nb_images, nb_col, nb_line, band_combo, dpi)
+    if key not in _templates:
+        _templates[key] = PageTemplate(*key)
+
+    return _templates[key]
+
+
+def get_thumbnails(
+    bounds: tuple,
+    files: list,
+    titles: list,
+    enhance_method: str,
+    stretch_mode: str = "image",
+    limits: Optional[tuple] = None,
+) -> List[tuple]:
+    """Read and enhance the thumbnails of a point.
+
+    Args:
+        bounds: the bounds of the buffer
+        files: the vrt file of each mosaic
+        titles: the title of each thumbnail
+        enhance_method: the method used to enhance the bands
+        stretch_mode: "image" to stretch each thumbnail with its own statistics, "point" to share the statistics of all the years of the point and "campaign" to use the given limits
+        limits: the (low, high) limits shared by all the points in "campaign" mode
+
+    Returns:
+        the (data, extent, title) of each thumbnail, data being (height, width) for a single band and (height, width, bands) otherwise
+    """
+    images = [reproject(file, bounds) for file in files]
+
+    # the statistics of the point are accumulated over all the years in one pass
+    if stretch_mode == "point" and enhance_method in STRETCH_METHODS:
+        accumulator = StretchAccumulator()
+        for data, _ in images:
+            accumulator.update(data)
+        limits = accumulator.limits(enhance_method)
+    elif stretch_mode == "image":
+        limits = None
+
+    thumbnails = []
+    for (data, extent), title in zip(images, titles):
+
+        data = enhance_bands(data, enhance_method, limits)
+
+        if data.shape[0] == 1:
+            # When there is only one band, do not transpose; use a colormap
+            data = data.squeeze()  # Remove the single band dimension for display
+        else:
+            # For multi-band data, transpose to match (height, width, bands)
+            data = np.transpose(data, [1, 2, 0])
+
+        thumbnails.append((data, extent, title))
+
+    return thumbnails
+
+
+def render_page(
+    pdf: PdfPages,
+    page_title: str,
+    bounds: tuple,
+    square: tuple,
+    files: list,
+    titles: list,
+    enhance_method: str,
+    nb_col: int,
+    nb_line: int,
+    band_combo: str,
+    dpi: int = cp.pdf_dpi,
+    stretch_mode: str = "image",
+    limits: Optional[tuple] = None,
+) -> None:
+    """Render the page of a single point and append it to the pdf.
+
+    Args:
+        pdf: the opened pdf file
+        page_title: the title of the page
+        bounds: the bounds of the buffer
+        square: the x and y coordinates of the square drawn around the point
+        files: the vrt file of each mosaic
+        titles: the title of each thumbnail
+        enhance_method: the method used to enhance the bands
+        nb_col: the number of columns of the page
+        nb_line: the number of lines of the page
+        band_combo: the bands displayed in the thumbnails
+        dpi: the resolution of the rendered page
+        stretch_mode: how the stretch statistics are shared between the thumbnails
+        limits: the (low, high) limits shared by all the points in "campaign" mode
+    """
+    thumbnails = get_thumbnails(
+        bounds, files, titles, enhance_method, stretch_mode, limits
+    )
+
+    template = get_page_template(len(files), nb_col, nb_line, band_combo, dpi)
+    template.save(pdf, page_title, square, thumbnails)
+
+
+def render_part(
+    pdf_file: Path,
+    pages: Dict[str, dict],
+    callback: Optional[Callable] = None,
+    **kwargs,
+) -> Path:
+    """Render consecutive pages in a single pdf stream.
+
+    Args:
+        pdf_file: the pdf file of the part
+        pages: the arguments of render_page for each point of the part
+        callback: function called after each rendered page
+        kwargs: the layout arguments of render_page shared by all the pages
+
+    Returns:
+        the pdf file of the part
+    """
+    # write in a temporary file to only expose complete parts to the next runs
+    pdf_part = pdf_file.with_stem(pdf_file.stem + "_part")
+    with PdfPages(pdf_part) as pdf:
+        for page in pages.values():
+            render_page(pdf, **page, **kwargs)
+            if callback:
+                callback()
+
+    pdf_part.replace(pdf_file)
+
+    return pdf_file
+
+
+def get_contact_sheet(
+    page_title: str,
+    square: tuple,
+    thumbnails: list,
+    nb_col: int,
+    nb_line: int,
+    band_combo: str,
+) -> Image.Image:
+    """Assemble the thumbnails of a point in a single image without matplotlib.
+
+    Args:
+        page_title: the title of the sheet
+        square: the x and y coordinates of the square drawn around the point
+        thumbnails: the (data, extent, title) of each thumbnail
+        nb_col: the number of columns of the sheet
+        nb_line: the number of lines of the sheet
+        band_combo: the bands displayed in the thumbnails
+
+    Returns:
+        the contact sheet
+    """
+    # all the thumbnails are displayed in cells of the same size, small images
+    # are enlarged to remain readable
+    size = max([cp.sheet_min_cell] + [max(d.shape[:2]) for d, _, _ in thumbnails])
+    header, title_height = 40, 20
+    width = nb_col * size
+    height = header + nb_line * (size + title_height)
+
+    sheet = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(sheet)
+    font = ImageFont.load_default()
+    draw.text((10, header // 2), page_title, fill="black", font=font, anchor="lm")
+
+    for placement_id, (data, extent, title) in enumerate(thumbnails):
+
+        # single band are displayed with a colormap, multi band as RGB
+        data = np.nan_to_num(np.clip(data, 0, 1))
+        if data.ndim == 2:
+            data = _viridis[(data * 255).astype(np.uint8)]
+        else:
+            data = (data[..., :3] * 255).astype(np.uint8)
+
+        # keep the aspect ratio of the extent in the cell (as matplotlib would do)
+        xmin, ymin, xmax, ymax = extent
+        ratio = (xmax - xmin) / (ymax - ymin)
+        w, h = (
+            (size, round(size / ratio)) if ratio >= 1 else (round(size * ratio), size)
+        )
+        image = Image.fromarray(data).resize((w, h), Image.Resampling.NEAREST)
+
+        line, col = cp.getPositionPdf(placement_id, nb_col)
+        x0 = col * size
+        y0 = header + line * (size + title_height)
+        sheet.paste(image, (x0, y0 + title_height))
+        draw.text((x0 + 2, y0 + 2), title, fill="black", font=font)
+
+        # draw the square around the point in pixel coordinates
+        points = [
+            (
+                x0 + (x - xmin) / (xmax - xmin) * w,
+                y0 + title_height + (ymax - y) / (ymax - ymin) * h,
+            )
+            for x, y in zip(*square)
+        ]
+        draw.line(points, fill=cp.polygon_colors[band_combo], width=cp.polygon_width)
+
+    return sheet
+
+
+def write_contact_sheets(
+    folder: Path,
+    pages: Dict[str, dict],
+    callback: Optional[Callable] = None,
+    nb_col: int = 1,
+    nb_line: int = 1,
+    band_combo: str = "",
+    format: str = "png",
+) -> Path:
+    """Write one contact sheet image per point.
+
+    Args:
+        folder: the folder of the images
+        pages: the page arguments of each point
+        callback: function called after each written image
+        nb_col: the number of columns of the sheets
+        nb_line: the number of lines of the sheets
+        band_combo: the bands displayed in the thumbnails
+        format: the image format, "png" or "webp"
+
+    Returns:
+        the folder of the images
+    """
+    for name, page in pages.items():
+
+        thumbnails = get_thumbnails(
+            page["bounds"],
+            page["files"],
+            page["titles"],
+            page["enhance_method"],
+            page["stretch_mode"],
+            page["limits"],
+        )
+        sheet = get_contact_sheet(
+            page["page_title"], page["square"], thumbnails, nb_col, nb_line, band_combo
+        )
+
+        # in a temporary file to only expose complete images to the next runs
+        dst = folder / f"{name}.{format}"
+        part = dst.with_stem(dst.stem + "_part")
+        sheet.save(part, format=format.upper(), **cp.sheet_options[format])
+        part.replace(dst)
+
+        if callback:
+            callback()
+
+    return folder
+
+
+def write_cog_stacks(
+    folder: Path,
+    pages: Dict[str, dict],
+    callback: Optional[Callable] = None,
+    mosaics: list = [],
+    band_combo: str = "",
+) -> Path:
+    """Write one multi-band Cloud Optimized GeoTIFF per point.
+
+    The raw values of every mosaic are stacked as bands (named "{mosaic}_{band}") on the grid
+    of the finest mosaic, with internal overviews so that clients can only read what they need.
+
+    Args:
+        folder: the folder of the images
+        pages: the page arguments of each point
+        callback: function called after each written image
+        mosaics: the mosaics of the stack
+        band_combo: the bands of each mosaic, a GEE band combination or a Planet one
+
+    Returns:
+        the folder of the images
+    """
+    if band_combo in cp.planet_bands_combo:
+        bands = cp.planet_bands_combo[band_combo]
+        band_names = [cp.planet_band_names[b] for b in bands]
+    else:
+        band_names = band_combo.split(", ")
+
+    for name, page in pages.items():
+
+        images = [reproject(file, page["bounds"]) for file in page["files"]]
+
+        # the extents are all the same reprojected bounds, only the resolution changes
+        extent = images[0][1]
+        height = max(data.shape[1] for data, _ in images)
+        width = max(data.shape[2] for data, _ in images)
+        transform = from_bounds(*extent, width, height)
+
+        stack = np.full(
+            (len(images) * len(band_names), height, width), np.nan, dtype=np.float32
+        )
+        for i, (data, (xmin, ymin, xmax, ymax)) in enumerate(images):
+            warp.reproject(
+                data.astype(np.float32),
+                stack[i * len(band_names) : (i + 1) * len(band_names)],
+                src_transform=from_bounds(
+                    xmin, ymin, xmax, ymax, data.shape[2], data.shape[1]
+                ),
+                src_crs=CRS.from_epsg(3857),
+                dst_transform=transform,
+                dst_crs=CRS.from_epsg(3857),
+                dst_nodata=np.nan,
+                resampling=Resampling.nearest,
+            )
+
+        profile = {
+            "driver": "GTiff",
+            "count": stack.shape[0],
+            "height": height,
+            "width": width,
+            "dtype": "float32",
+            "crs": CRS.from_epsg(3857),
+            "transform": transform,
+            "nodata": np.nan,
+        }
+
+        # the COG driver can only copy an existing dataset
+        dst = folder / f"{name}.tif"
+        part = dst.with_stem(dst.stem + "_part")
+        with MemoryFile() as memfile:
+            with memfile.open(**profile) as f:
+                f.write(stack)
+                f.update_tags(title=page["page_title"])
+                descriptions = [f"{m}_{b}" for m in mosaics for b in band_names]
+                for i, description in enumerate(descriptions, 1):
+                    f.set_band_description(i, description)
+
+            with memfile.open() as f:
+                rio_copy(f, part, driver="COG", **cp.cog_options)
+
+        part.replace(dst)
+
+        if callback:
+            callback()
+
+    return folder
+
+
+def get_pages(
+    geometry: gpd.GeoDataFrame,
+    mosaics: list,
+    image_size: int,
+    square_size: int,
+    vrt_list: dict,
+    title_list: dict,
+    enhance_method: str,
+    stretch_mode: str = "image",
+) -> Dict[str, dict]:
+    """Gather the page arguments of every point in the order of the points.
+
+    In "campaign" stretch mode, the limits shared by all the pages are computed from a
+    sample of the points.
+
+    Returns:
+        the page arguments indexed by the sanitized name of each point, made unique
+        with the position of the point if needed
+    """
+    # build the geometries that will be drawn on the thumbnails
+    # can stay in EPSG:3857 as it will be used in this projection
+    geoms = geometry.to_crs(3857)
+    geoms.geometry = geoms.buffer(square_size / 2, cap_style=3)
+
+    buffers = get_buffers(geometry, image_size)
+
+    pages = {}
+    for position, (index, r) in enumerate(buffers.iterrows()):
+
+        name = re.sub("[^a-zA-Z\\d\\-\\_]", "_", unidecode(str(r.id)))
+
+        # duplicated ids (or ids with the same sanitized name) would overwrite the
+        # page of the previous point, the position of the row makes them unique
+        if name in pages:
+            name = f"{name}_{position}"
+        while name in pages:
+            name += "_"
+
+        # the centroid is a point so I can safely take the first coords
+        lat, lng = r.geometry.centroid.coords[0]
+
+        # create the square polygon
+        x_polygon, y_polygon = geoms.loc[index]["geometry"].exterior.coords.xy
+
+        pages[name] = dict(
+            page_title=f"Id: {name} (lat:{lat:.5f}, lng:{lng:.5f})",
+            bounds=r.geometry.bounds,
+            square=(list(x_polygon), list(y_polygon)),
+            files=[vrt_list[m] for m in mosaics],
+            titles=[title_list[m][index] for m in mosaics],
+            enhance_method=enhance_method,
+            stretch_mode=stretch_mode,
+            limits=None,
+        )
+
+    if stretch_mode == "campaign" and enhance_method in STRETCH_METHODS:
+        limits = get_campaign_limits(pages, enhance_method)
+        for page in pages.values():
+            page["limits"] = limits
+
+    return pages
+
+
+def get_campaign_limits(
+    pages: Dict[str, dict],
+    enhance_method: str,
+    sample_points: int = cp.stretch_sample_points,
+    seed: int = 0,
+) -> tuple:
+    """Compute the stretch limits shared by all the points of the campaign.
+
+    The statistics are accumulated over all the years of a random (but reproducible)
+    subset of the points instead of reading every image of the campaign.
+
+    Args:
+        pages: the page arguments of each point
+        enhance_method: the method used to enhance the bands
+        sample_points: the maximum number of points read
+        seed: the seed of the sample
+
+    Returns:
+        the (low, high) limits of each band
+    """
+    names = list(pages)
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(names), min(sample_points, len(names)), replace=False)
+
+    accumulator = StretchAccumulator(seed=seed)
+    for i in sorted(sample):
+        page = pages[names[i]]
+        for file in page["files"]:
+            data, _ = reproject(file, page["bounds"])
+            accumulator.update(data)
+
+    return accumulator.limits(enhance_method)
+
+
+def split_pages(pages: Dict[str, dict]) -> List[tuple]:
+    """Split the pages in parts of consecutive points.
+
+    The parts have cp.pdf_pages_per_part points, or more when it would make more than
+    cp.pdf_max_parts parts. They only depend on the points so that the parts rendered in
+    a previous run are found again whatever the number of workers.
+
+    Returns:
+        the (start, end, pages) of each part
+    """
+    names = list(pages)
+    part_size = max(cp.pdf_pages_per_part, ceil(len(names) / cp.pdf_max_parts), 1)
+
+    parts = []
+    for start in range(0, len(names), part_size):
+        end = min(start + part_size, len(names))
+        parts.append((start, end, {n: pages[n] for n in names[start:end]}))
+
+    return parts
+
+
+def get_mp_context() -> multiprocessing.context.BaseContext:
+    """Return the context used to start the render processes.
+
+    The exports run in a Jupyter kernel that has threads and opened GDAL datasets, a
+    forked copy of it can deadlock. The processes are forked from a clean forkserver
+    that already imported this module (or spawned where forkserver does not exist).
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["__main__", __name__])
+        return context
+
+    return multiprocessing.get_context("spawn")
+
+
+def run_render_tasks(
+    func: Callable,
+    tasks: Dict[str, tuple],
+    output: "cw.CustomAlert",
+    manifest: Optional[JobManifest] = None,
+    max_workers: int = cp.pdf_max_workers,
+    gdal_cache: Optional[int] = None,
+) -> None:
+    """Run the render tasks in a process pool and report their progress.
+
+    Args:
+        func: the render function called as func(dst, pages, callback)
+        tasks: the (dst, pages) of each task indexed by their manifest key
+        output: the alert to report the progress
+        manifest: the manifest of the job
+        max_workers: the number of processes, 1 to render in the main process
+        gdal_cache: the size of the GDAL block cache of each process (in bytes)
+    """
+    if gdal_cache:
+        set_gdal_cache(gdal_cache)
+
+    if manifest:
+        for key in tasks:
+            manifest.set_status(key, PENDING)
+
+    if max_workers > 1 and len(tasks) > 1:
+
+        # render the parts in parallel, each worker write its own files
+        # the progress and the manifest are only updated from the main process
+        initargs = (gdal_cache,) if gdal_cache else ()
+        initializer = set_gdal_cache if gdal_cache else None
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=get_mp_context(),
+            initializer=initializer,
+            initargs=initargs,
+        ) as executor:
+            futures = {
+                executor.submit(func, dst, pages): key
+                for key, (dst, pages) in tasks.items()
+            }
+            try:
+                for future in as_completed(futures):
+                    future.result()
+                    key = futures[future]
+                    if manifest:
+                        manifest.set_status(key, RENDERED)
+                    for _ in tasks[key][1]:
+                        output.update_progress()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    else:
+        for key, (dst, pages) in tasks.items():
+            func(dst, pages, output.update_progress)
+            if manifest:
+                manifest.set_status(key, RENDERED)
+
+
 def get_pdf(
     input_file_path: Path,
     mosaics: list,
@@ -42,143 +712,156 @@ def get_pdf(
     title_list: dict,
     band_combo,
     geometry: gpd.GeoDataFrame,
-    output: cw.CustomAlert,
+    output: "cw.CustomAlert",
     tmp_dir: str,
     enhance_method: str = "min_max",
     sources: list = [],
+    manifest: Optional[JobManifest] = None,
+    max_workers: int = cp.pdf_max_workers,
+    dpi: int = cp.pdf_dpi,
+    stretch_mode: str = "image",
 ):
     pdf_filepath = get_pdf_path(
         input_file_path.stem, sources, band_combo, image_size, enhance_method
     )
-    # build the geometries that will be drawn on the thumbnails
-    # can stay in EPSG:3857 as it will be used in this projection
-    geoms = geometry.to_crs(3857)
-    geoms.geometry = geoms.buffer(square_size / 2, cap_style=3)
 
-    buffers = get_buffers(geometry, image_size)
+    if stretch_mode == "campaign":
+        output.add_live_msg("Compute the stretch shared by all the points")
+    pages = get_pages(
+        geometry,
+        mosaics,
+        image_size,
+        square_size,
+        vrt_list,
+        title_list,
+        enhance_method,
+        stretch_mode,
+    )
 
     # get the disposition in col and line
     nb_col, nb_line = cp.get_dims(len(mosaics))
 
-    pdf_tmps = []
+    # the pages are streamed in parts of consecutive points, each completed part is a
+    # checkpoint of the job
+    pdf_files, tasks = [], {}
+    for start, end, part in split_pages(pages):
+        pdf_file = tmp_dir / f"{pdf_filepath.stem}_tmp_pages_{start:06d}_{end:06d}.pdf"
+        pdf_files.append(pdf_file)
 
-    output.reset_progress(len(buffers), "Pdf page created")
-    for index, r in buffers.iterrows():
+        # skip the parts rendered in a previous run of the job
+        if not pdf_file.is_file():
+            tasks[f"pdf/{pdf_file.stem}"] = (pdf_file, part)
 
-        name = re.sub("[^a-zA-Z\\d\\-\\_]", "_", unidecode(str(r.id)))
-
-        pdf_tmp = tmp_dir / f"{pdf_filepath.stem}_tmp_pts_{name}.pdf"
-        pdf_tmps.append(pdf_tmp)
-
-        if pdf_tmp.is_file():
-            continue
+    output.reset_progress(len(pages), "Pdf page created")
+    for _ in range(len(pages) - sum(len(p) for _, p in tasks.values())):
+        output.update_progress()
 
-        # create the resulting pdf
-        with PdfPages(pdf_tmp) as pdf:
+    func = partial(
+        render_part, nb_col=nb_col, nb_line=nb_line, band_combo=band_combo, dpi=dpi
+    )
+    gdal_cache = get_gdal_cache_size(list(vrt_list.values()), image_size, max_workers)
+    run_render_tasks(func, tasks, output, manifest, max_workers, gdal_cache)
+
+    # a single part is already the final file, otherwise merge the parts in the
+    # order of the points
+    if len(pdf_files) == 1:
+        pdf_files[0].replace(pdf_filepath)
+    else:
+        output.add_live_msg("merge all pdf files")
+        merger = PdfWriter()
+        for pdf in pdf_files:
+            merger.append(pdf, import_outline=False)
+        merger.write(str(pdf_filepath))
+
+    # the job folder is removed by the caller once the output is delivered
+    dataset_pool.close()
 
-            # the centroid is a point so I can safely take the first coords
-            lat, lng = r.geometry.centroid.coords[0]
+    output.add_live_msg(f"PDF output finished: {pdf_filepath}", "success")
 
-            page_title = f"Id: {name} (lat:{lat:.5f}, lng:{lng:.5f})"
+    return pdf_filepath
 
-            fig, axes = plt.subplots(
-                nb_line, nb_col, figsize=(11.69, 8.27), dpi=500, constrained_layout=True
-            )
 
-            # I reshape by default to avoid a crash
-            # if nb_line = 1 the dimension of the table is reduced
-            axes = np.array(axes, dtype=object).reshape(nb_line, nb_col)
-
-            fig.suptitle(page_title, fontsize=16, fontweight="bold")
-
-            # display the images in a fig and export it as a pdf page
-            placement_id = 0
-
-            for mosaic in mosaics:
-
-                # load the file
-                file = vrt_list[mosaic]
-
-                # extract the buffer bounds
-                bounds = r.geometry.bounds
-
-                data, (xmin, ymin, xmax, ymax) = reproject(file, bounds)
-
-                bands = []
-                for i in range(data.shape[0]):
-                    enhanced_band = enhance_band(data[i], enhance_method)
-                    bands.append(enhanced_band)
-
-                data = np.stack(bands, axis=0)
-
-                if data.shape[0] == 1:
-                    # When there is only one band, do not transpose; use a colormap
-                    data = (
-                        data.squeeze()
-                    )  # Remove the single band dimension for display
-                    cmap = "viridis"  # Or another appropriate colormap like 'gray', 'RdYlGn', etc.
-                else:
-                    # For multi-band data, transpose to match (height, width, bands)
-                    data = np.transpose(data, [1, 2, 0])
-                    cmap = None  # Default, for RGB
-
-                # create the square polygon
-                x_polygon, y_polygon = geoms.loc[index]["geometry"].exterior.coords.xy
-
-                place = cp.getPositionPdf(placement_id, nb_col)
-                ax = axes[place[0], place[1]]
-                ax.imshow(
-                    data,
-                    interpolation="nearest",
-                    extent=[xmin, xmax, ymin, ymax],
-                    cmap=cmap,  # Use the defined colormap for single-band images
-                )
-
-                ax.plot(
-                    x_polygon,
-                    y_polygon,
-                    color=cp.polygon_colors[band_combo],
-                    linewidth=cp.polygon_width,
-                )
-
-                ax.set_title(
-                    title_list[mosaic][index],
-                    x=0.0,
-                    y=1.0,
-                    fontsize="small",
-                    backgroundcolor="white",
-                    ha="left",
-                )
-                ax.axis("off")
-                ax.set_aspect("equal", "box")
-
-                # increment the placement image
-                placement_id += 1
-
-            # finish the file with empty plots if needed
-            while placement_id < nb_line * nb_col:
-                place = cp.getPositionPdf(placement_id, nb_col)
-                ax = axes[place[0], place[1]]
-                ax.axis("off")
-                ax.set_aspect("equal", "box")
-
-                placement_id += 1
-
-            # save the page
-            pdf.savefig(fig)
-            plt.close("all")
-        output.update_progress()
+def get_images(
+    input_file_path: Path,
+    mosaics: list,
+    image_size: int,
+    square_size: int,
+    vrt_list: dict,
+    title_list: dict,
+    band_combo,
+    geometry: gpd.GeoDataFrame,
+    output: "cw.CustomAlert",
+    tmp_dir: str,
+    enhance_method: str = "min_max",
+    sources: list = [],
+    manifest: Optional[JobManifest] = None,
+    max_workers: int = cp.pdf_max_workers,
+    format: str = "png",
+    stretch_mode: str = "image",
+) -> Path:
+    """Export one file per point in a folder instead of a pdf.
+
+    Same arguments as get_pdf, format being "png" or "webp" for contact sheets and "cog"
+    for Cloud Optimized GeoTIFF stacks of the raw values.
+
+    Returns:
+        the folder of the images
+    """
+    folder = get_output_path(
+        input_file_path.stem, sources, band_combo, image_size, enhance_method, format
+    )
+    # the images of the folder are the checkpoints of the job, they are only kept
+    # when resuming an interrupted export
+    resuming = manifest and any(k.startswith(f"{format}/") for k in manifest.tasks)
+    if folder.is_dir() and not resuming:
+        shutil.rmtree(folder)
+    folder.mkdir(exist_ok=True)
+
+    if stretch_mode == "campaign":
+        output.add_live_msg("Compute the stretch shared by all the points")
+    pages = get_pages(
+        geometry,
+        mosaics,
+        image_size,
+        square_size,
+        vrt_list,
+        title_list,
+        enhance_method,
+        stretch_mode,
+    )
 
-    # merge all the pdf files
-    output.add_live_msg("merge all pdf files")
-    merger = PdfWriter()
-    for pdf in pdf_tmps:
-        merger.append(pdf)
-    merger.write(str(pdf_filepath))
+    # skip the points exported in a previous run of the job
+    extension = "tif" if format == "cog" else format
+    todo = {
+        n: p for n, p in pages.items() if not (folder / f"{n}.{extension}").is_file()
+    }
 
-    # flush the tmp repository
-    remove_tmp_dir(tmp_dir)
+    tasks = {
+        f"{format}/{start:06d}_{end:06d}": (folder, part)
+        for start, end, part in split_pages(todo)
+    }
 
-    output.add_live_msg(f"PDF output finished: {pdf_filepath}", "success")
+    output.reset_progress(len(pages), "Image created")
+    for _ in range(len(pages) - len(todo)):
+        output.update_progress()
 
-    return pdf_filepath
+    if format == "cog":
+        func = partial(write_cog_stacks, mosaics=mosaics, band_combo=band_combo)
+    else:
+        nb_col, nb_line = cp.get_dims(len(mosaics))
+        func = partial(
+            write_contact_sheets,
+            nb_col=nb_col,
+            nb_line=nb_line,
+            band_combo=band_combo,
+            format=format,
+        )
+    gdal_cache = get_gdal_cache_size(list(vrt_list.values()), image_size, max_workers)
+    run_render_tasks(func, tasks, output, manifest, max_workers, gdal_cache)
+
+    # the job folder is removed by the caller once the output is delivered
+    dataset_pool.close()
+
+    output.add_live_msg(f"Images output finished: {folder}", "success")
+
+    return folder
@@ -1,18 +1,29 @@
 import concurrent.futures
+import queue
+import shutil
 import threading
 import zipfile
+from contextlib import nullcontext
+from datetime import datetime
+from math import cos, radians
 from pathlib import Path
-from typing import List, Literal, Tuple
-from urllib.request import urlretrieve
+from typing import TYPE_CHECKING, Callable, List, Literal, Optional, Tuple
+from urllib.request import urlopen
 
 import ee
+import geopandas as gpd
+import numpy as np
 from osgeo import gdal
 from sepal_ui.scripts.utils import init_ee
 
 from component import parameter as cp
-from component import widget as cw
 
-from .utils import get_buffers, get_vrt_filename
+from .cache import get_cache_key, get_geometry_hash, tile_cache
+from .manifest import DOWNLOADED, PENDING, JobManifest
+from .utils import TokenBucket, call_with_backoff, get_buffers, get_vrt_filename
+
+if TYPE_CHECKING:
+    from component import widget as cw
 
 init_ee()
 
@@ -23,6 +34,7 @@ class Params(TypedDict):
     link: str  # The URL link to download the image from
     description: str  # A description of the image
     tmp_dir: str  # The temporary directory to store the downloaded image
+    cache_key: Optional[str]  # The key of the image in the tile cache, None to skip it
 
 
 def get_gee_vrt(
@@ -32,32 +44,36 @@ def get_gee_vrt(
     filename: str,
     bands: str,
     sources,
-    output: cw.CustomAlert,
+    output: "cw.CustomAlert",
     tmp_dir: Path,
+    manifest: Optional[JobManifest] = None,
+    native_crs: bool = cp.native_crs,
 ):
     filename = get_vrt_filename(filename, sources, bands, image_size)
     ee_buffers = get_buffers(gdf=geometry, size=image_size, gee=True)
+    buffers = get_buffers(gdf=geometry, size=image_size)
 
     # Create a filename list
     descriptions = {year: f"{filename}_{year}" for year in mosaics}
 
     nb_points = max(1, len(ee_buffers))
     total_images = len(mosaics) * nb_points
-    output.reset_progress(total_images, "Requesting images....")
-
-    # Collect EE API results
-    ee_tasks, satellites = get_ee_tasks(
-        mosaics, ee_buffers, descriptions, sources, bands, tmp_dir, output
+    output.reset_progress(2 * total_images, "Requesting and downloading images....")
+
+    # Request, download and gather the images in overlapping stages
+    vrt_list, satellites = stream_gee_images(
+        mosaics,
+        ee_buffers,
+        descriptions,
+        sources,
+        bands,
+        tmp_dir,
+        output,
+        manifest,
+        native_crs,
+        buffers,
     )
 
-    output.reset_progress(total_images, "Downloading images....")
-
-    # Download images in parallel and get the downloaded file paths
-    downloaded_files = download_images_in_parallel(ee_tasks, output)
-
-    # Create VRT files per year using the downloaded file paths and descriptions
-    vrt_list = create_vrt_per_year(downloaded_files, descriptions, tmp_dir)
-
     # Generate title list
     title_list = generate_title_list(mosaics, satellites, ee_buffers)
 
@@ -93,8 +109,10 @@ def get_ee_image(
     return dataset, ee_image
 
 
-def visible_pixel(ee_image: ee.Image, aoi: ee.geometry.Geometry, scale: int) -> float:
-    """get the proportion of visible pixel in the image."""
+def visible_pixel_ratio(
+    ee_image: ee.Image, aoi: ee.geometry.Geometry, scale: int
+) -> ee.Number:
+    """get the proportion of visible pixel in the image as a server side number."""
 
     # get the number of masked pixel
     pixel_masked = (
@@ -121,164 +139,555 @@ def visible_pixel(ee_image: ee.Image, aoi: ee.geometry.Geometry, scale: int) ->
         .get(0)
     )
 
-    return ee.Number(pixel_masked).divide(ee.Number(pixel)).multiply(100).getInfo()
+    return ee.Number(pixel_masked).divide(ee.Number(pixel)).multiply(100)
 
 
-def get_image(
+def get_selection_table(
     sources: Literal["sentinel", "landsat"],
     bands: str,
-    aoi: ee.geometry.Geometry,
+    ee_buffers: List[ee.Geometry],
     year: int,
-):
-    # print("get_image", sources, bands, aoi, year)
+) -> List[list]:
+    """Compute the image count and the visible pixel proportion of every candidate satellite for every buffer.
+
+    All the buffers are gathered in a single ee.FeatureCollection and the statistics are computed
+    in one mapped server-side expression. The buffers are sent by chunks of
+    ``cp.gee_selection_chunk_size`` features to stay below the Earth Engine computation limits.
+
+    Returns:
+        one row per buffer (in the ee_buffers order) with the ``[count, visible]`` values of each
+        satellite of ``cp.getSatellites(sources, year)`` flattened in priority order.
+    """
     start = str(year) + "-01-01"
     end = str(year) + "-12-31"
 
     # priority selector for satellites
     satellites = cp.getSatellites(sources, year)
 
-    for satellite_id in satellites:
+    def compute_stats(feature):
+        aoi = feature.geometry()
 
-        dataset, ee_image = get_ee_image(
-            satellites, satellite_id, start, end, bands, aoi
-        )
+        stats = []
+        for satellite_id in satellites:
+            dataset, ee_image = get_ee_image(
+                satellites, satellite_id, start, end, bands, aoi
+            )
+            scale = cp.getScale(satellite_id)
+
+            # only compute the visible pixels if the dataset is not empty
+            size = dataset.size()
+            visible = ee.Algorithms.If(
+                size, visible_pixel_ratio(ee_image, aoi, scale), 0
+            )
+            stats += [size, visible]
+
+        return feature.set("stats", ee.List(stats))
+
+    table = []
+    chunk_size = cp.gee_selection_chunk_size
+    for i in range(0, len(ee_buffers), chunk_size):
+        features = [ee.Feature(buffer) for buffer in ee_buffers[i : i + chunk_size]]
+        stats = ee.FeatureCollection(features).map(compute_stats)
+        table += stats.aggregate_array("stats").getInfo()
+
+    return table
 
-        scale = cp.getScale(satellite_id)
 
-        visible = 0
-        if dataset.size().getInfo():
+def select_satellite(satellites: dict, stats: list) -> str:
+    """Select the first satellite with more than 50% of visible pixels from a selection table row."""
 
-            # get the proportion of visible pixel
-            visible = visible_pixel(ee_image, aoi, scale)
-            # print(visible, satellite_id)
+    for i, satellite_id in enumerate(satellites):
+
+        count, visible = stats[2 * i], stats[2 * i + 1]
+        visible = (visible or 0) if count else 0
 
         # if its the last one I'll keep it anyway
         if visible > 50:
             break
 
-    return (ee_image, satellite_id)
+    return satellite_id
 
 
-def get_ee_tasks(
-    mosaics, ee_buffers, descriptions, sources, bands, tmp_dir, output
-) -> Tuple[dict[int, List[Params]], dict]:
-    """
-    Collect Earth Engine API results for each buffer and year.
+def get_satellites_selection(
+    sources: Literal["sentinel", "landsat"],
+    bands: str,
+    ee_buffers: List[ee.Geometry],
+    year: int,
+) -> List[str]:
+    """Get the satellite that will be used for each buffer of a given year."""
 
-    Returns:
-        ee_tasks: A dictionary containing download parameters per year.
-        satellites: A dictionary tracking the satellites used per year and buffer.
+    satellites = cp.getSatellites(sources, year)
+    table = get_selection_table(sources, bands, ee_buffers, year)
+
+    return [select_satellite(satellites, stats) for stats in table]
+
+
+def get_ee_task(
+    sources: Literal["sentinel", "landsat"],
+    bands: str,
+    buffer: ee.geometry.Geometry,
+    year: int,
+    satellite_id: str,
+    description: str,
+    tmp_dir: Path,
+    native_crs: bool = cp.native_crs,
+    latitude: Optional[float] = None,
+) -> Params:
+    """Request the download URL of a single buffer for a given year and satellite.
+
+    With native_crs the image is requested in EPSG:3857, the display projection of the
+    thumbnails, instead of the default EPSG:4326 grid. The pixels are snapped on a grid
+    starting at the origin of the projection and sized for the given latitude (see
+    ``get_grid_latitude``) so that the images requested with the same latitude can be
+    gathered in a VRT without resampling.
     """
-    satellites = {}
-    ee_tasks = {}
-    for year in mosaics:
 
-        satellites[year] = [None] * len(ee_buffers)
-        ee_tasks[year] = []
+    start = str(year) + "-01-01"
+    end = str(year) + "-12-31"
+
+    scale = cp.getScale(satellite_id)
+    geojson = buffer.toGeoJSON()
+    geometry_hash = get_geometry_hash(geojson)
+
+    # the pixels of EPSG:3857 are stretched by 1/cos(lat) on the ground, adapt the
+    # scale to keep the resolution of the satellite
+    crs = []
+    if native_crs:
+        latitude = get_grid_latitude([buffer]) if latitude is None else latitude
+        scale = scale / cos(radians(latitude))
+        crs = ["EPSG:3857"]
+
+    # the composites of a year that is not over yet still change, they are never cached
+    cache_key = None
+    if year < datetime.now().year:
+        cache_key = get_cache_key(
+            "gee", satellite_id, year, bands, scale, geometry_hash, *crs
+        )
+
+    params = {
+        "link": None,
+        "description": description,
+        "tmp_dir": tmp_dir,
+        "cache_key": cache_key,
+    }
+
+    # no need to request the URL of an image that is already downloaded or in the cache
+    dst = tmp_dir / f"{description}.tif"
+    if dst.is_file() or (cache_key and tile_cache.get(cache_key, dst)):
+        return params
 
-        for j, buffer in enumerate(ee_buffers):
+    satellites = cp.getSatellites(sources, year)
+    _, image = get_ee_image(satellites, satellite_id, start, end, bands, buffer)
 
-            image, sat = get_image(sources, bands, buffer, year)
-            if sat is None:
-                print(f"Year: {year}, Buffer index: {j}")
+    name = f"{description}_zipimage"
 
-            satellites[year][j] = sat
+    request = {
+        "name": name,
+        "region": buffer,
+        "filePerBand": False,
+        "scale": scale,
+        "format": "GEO_TIFF",
+    }
 
-            description = f"{descriptions[year]}_{j}"
-            name = f"{description}_zipimage"
+    if native_crs:
+        del request["scale"]
+        request.update(crs="EPSG:3857", crs_transform=[scale, 0, 0, 0, -scale, 0])
 
-            # Get the download URL
-            link = image.getDownloadURL(
-                {
-                    "name": name,
-                    "region": buffer,
-                    "filePerBand": False,
-                    "scale": cp.getScale(sat),
-                }
-            )
+    # Get the download URL
+    params["link"] = image.getDownloadURL(request)
 
-            # Store the necessary information for downloading
-            ee_tasks[year].append(
-                {
-                    "link": link,
-                    "description": description,
-                    "tmp_dir": tmp_dir,
-                }
+    # Store the necessary information for downloading
+    return params
+
+
+def get_grid_latitude(ee_buffers: List[ee.Geometry]) -> float:
+    """Return the latitude of the buffers the closest to the equator.
+
+    The ground size of the EPSG:3857 pixels shrinks with cos(lat), a grid sized for this
+    latitude keeps at least the resolution of the satellite on every buffer.
+    """
+    latitudes = []
+    for buffer in ee_buffers:
+        lats = np.array(buffer.toGeoJSON()["coordinates"][0])[:, 1]
+        latitudes.append(0.0 if lats.min() <= 0 <= lats.max() else np.abs(lats).min())
+
+    return float(min(latitudes))
+
+
+def get_clusters(
+    bounds: np.ndarray,
+    satellites: List[str],
+    max_pixels: int = cp.gee_cluster_max_pixels,
+    max_ratio: float = cp.gee_cluster_max_area_ratio,
+) -> List[List[int]]:
+    """Group the close buffers that use the same satellite to download them in a single region.
+
+    The buffers are binned on a regular grid in EPSG:3857 by their center. The cells are
+    small enough for the bounding box of a group to stay below max_pixels on each side
+    (EPSG:3857 meters are never larger than the ground ones). A group is only kept if its
+    bounding box is not larger than max_ratio times the area of its buffers and doesn't
+    intersect any other buffer (that could use another satellite), otherwise its buffers
+    are requested one by one.
+
+    Args:
+        bounds: the (minx, miny, maxx, maxy) of each buffer in EPSG:3857
+        satellites: the satellite used by each buffer
+        max_pixels: the maximum side of a group in pixels of the satellite
+        max_ratio: the maximum ratio between the area of a group and the sum of its buffers areas
+
+    Returns:
+        the indices of the buffers of each group, ordered by their first buffer
+    """
+    width, height = bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1]
+    centers = (bounds[:, :2] + bounds[:, 2:]) / 2
+    satellites = np.asarray(satellites)
+
+    clusters = []
+    for satellite_id in np.unique(satellites):
+        index = np.flatnonzero(satellites == satellite_id)
+
+        # buffers larger than the budget are never grouped
+        cell = max_pixels * cp.getScale(satellite_id)
+        cell -= max(width[index].max(), height[index].max())
+        if cell <= 0:
+            clusters += [[j] for j in index.tolist()]
+            continue
+
+        cells = np.floor(centers[index] / cell).astype(np.int64)
+        _, groups = np.unique(cells, axis=0, return_inverse=True)
+        for group in np.unique(groups.ravel()):
+            members = index[groups.ravel() == group]
+            b = bounds[members]
+            minx, miny = b[:, 0].min(), b[:, 1].min()
+            maxx, maxy = b[:, 2].max(), b[:, 3].max()
+            area = (maxx - minx) * (maxy - miny)
+
+            others = np.delete(bounds, members, axis=0)
+            overlaps = (
+                (others[:, 0] < maxx)
+                & (others[:, 2] > minx)
+                & (others[:, 1] < maxy)
+                & (others[:, 3] > miny)
             )
 
-            output.update_progress()
+            small = area <= max_ratio * (width * height)[members].sum()
+            if len(members) > 1 and small and not overlaps.any():
+                clusters.append(members.tolist())
+            else:
+                clusters += [[j] for j in members.tolist()]
 
-    return ee_tasks, satellites
+    return sorted(clusters, key=lambda c: c[0])
 
 
-def download_images_in_parallel(ee_tasks: dict[int, Params], output):
+def get_ee_tasks(
+    mosaics,
+    ee_buffers,
+    descriptions,
+    sources,
+    bands,
+    tmp_dir,
+    output,
+    max_workers: int = cp.gee_max_workers,
+    on_task: Optional[Callable[[int, int, Params], None]] = None,
+    progress_lock: Optional[threading.Lock] = None,
+    manifest: Optional[JobManifest] = None,
+    native_crs: bool = cp.native_crs,
+    buffers: Optional[gpd.GeoDataFrame] = None,
+) -> Tuple[dict[int, List[Params]], dict]:
     """
-    Download images in parallel using ThreadPoolExecutor.
+    Collect Earth Engine API results for each buffer and year.
+
+    The satellite selection of all the buffers is computed at once for each year
+    (see ``get_selection_table``), then the download URL are requested buffer by buffer.
+    If the buffers geometries are given, the close buffers using the same satellite are
+    requested as a single region (see ``get_clusters``) and share the same download
+    parameters.
+    Every request is sent from a pool of ``max_workers`` threads, limited to
+    ``cp.gee_requests_per_second`` and retried with an exponential backoff when
+    Earth Engine refuses too many concurrent requests.
+
+    Args:
+        on_task: a function called with the year, the indices of the buffers and the
+            download parameters of each region as soon as its URL is available. If it
+            raises, the pending requests are cancelled.
+        progress_lock: a threading.Lock() instance if the progress is shared with other threads.
+        manifest: the manifest of the job, the satellites selected in a previous run are reused.
+        native_crs: request the images in EPSG:3857 instead of EPSG:4326, on a single grid.
+        buffers: the buffers of ee_buffers in EPSG:4326, to group them in shared regions.
 
     Returns:
-        downloaded_files: A dictionary mapping each year to a list of downloaded file paths.
+        ee_tasks: A dictionary containing download parameters per year.
+        satellites: A dictionary tracking the satellites used per year and buffer.
     """
-    # Create a lock for thread-safe progress updates
-    progress_lock = threading.Lock()
-    downloaded_files = {}  # To store the downloaded file paths
+    bucket = TokenBucket(cp.gee_requests_per_second)
+
+    def request(func, *args):
+        return call_with_backoff(
+            func,
+            *args,
+            bucket=bucket,
+            max_retries=cp.gee_max_retries,
+            backoff=cp.gee_backoff_factor,
+        )
+
+    satellites = {year: [None] * len(ee_buffers) for year in mosaics}
+    ee_tasks = {year: [None] * len(ee_buffers) for year in mosaics}
+
+    if buffers is not None:
+        bounds = buffers.bounds.to_numpy()
+        projected_bounds = buffers.to_crs(3857).bounds.to_numpy()
+
+    # all the images of the job are requested on the same EPSG:3857 grid
+    latitude = get_grid_latitude(ee_buffers) if native_crs else None
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+    tasks = {}
+
+    def submit_tasks(year):
+        if buffers is None:
+            clusters = [[j] for j in range(len(ee_buffers))]
+        else:
+            clusters = get_clusters(projected_bounds, satellites[year])
+
+        for cluster in clusters:
+            j = cluster[0]
+            sat = satellites[year][j]
+
+            for k in cluster:
+                key = f"gee/{year}/{k}"
+                if manifest and not manifest.get(key):
+                    manifest.set_status(key, PENDING, satellite=sat)
+
+            # a group is requested as the bounding box of its buffers, with the
+            # vertices in the same order as the buffers
+            if len(cluster) == 1:
+                region, description = ee_buffers[j], f"{descriptions[year]}_{j}"
+            else:
+                b = bounds[cluster]
+                minx, miny = b[:, 0].min(), b[:, 1].min()
+                maxx, maxy = b[:, 2].max(), b[:, 3].max()
+                coords = [[maxx, maxy], [maxx, miny], [minx, miny], [minx, maxy]]
+                region = ee.Geometry.Polygon([coords + coords[:1]])
+                description = f"{descriptions[year]}_group_{j}"
+
+            args = (sources, bands, region, year, sat, description, tmp_dir)
+            future = executor.submit(request, get_ee_task, *args, native_crs, latitude)
+            tasks[future] = (year, cluster)
+
+    try:
+        # select the satellites of every year concurrently
+        # unless they were already selected in a previous run of the job
+        selections = {}
+        for year in mosaics:
+            keys = [f"gee/{year}/{j}" for j in range(len(ee_buffers))]
+            if manifest and all(manifest.get(k) for k in keys):
+                satellites[year] = [manifest.get(k)["satellite"] for k in keys]
+                submit_tasks(year)
+            else:
+                args = (sources, bands, ee_buffers, year)
+                future = executor.submit(request, get_satellites_selection, *args)
+                selections[future] = year
+
+        # request the urls as soon as the satellites of a year are known
+        for future in concurrent.futures.as_completed(selections):
+            year = selections[future]
+            satellites[year] = future.result()
+            submit_tasks(year)
+
+        for future in concurrent.futures.as_completed(tasks):
+            year, cluster = tasks[future]
+            params = future.result()
+            for j in cluster:
+                ee_tasks[year][j] = params
+
+            if on_task:
+                on_task(year, cluster, params)
+
+            with progress_lock or nullcontext():
+                for _ in cluster:
+                    output.update_progress()
+
+    except BaseException:
+        # don't wait for the pending requests if the results are not used anymore
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+
+    executor.shutdown()
+
+    return ee_tasks, satellites
 
-    for year, download_params_list in ee_tasks.items():
-        downloaded_files[year] = []
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = {
-                executor.submit(download_image, params, progress_lock, output): params
-                for params in download_params_list
-            }
 
-            # Collect results as they complete
-            for future in concurrent.futures.as_completed(futures):
-                e = future.exception()
-                if e:
-                    raise e  # Rethrow the first exception encountered
+def stream_gee_images(
+    mosaics,
+    ee_buffers,
+    descriptions,
+    sources,
+    bands,
+    tmp_dir,
+    output,
+    manifest: Optional[JobManifest] = None,
+    native_crs: bool = cp.native_crs,
+    buffers: Optional[gpd.GeoDataFrame] = None,
+) -> Tuple[dict[int, Path], dict]:
+    """
+    Request, download and gather the images in a producer/consumer pipeline.
 
-                # Get the result (downloaded file path) and store it
-                file_path = future.result()
-                downloaded_files[year].append(file_path)
+    The 3 stages communicate through a single queue of events so that they overlap:
 
-    return downloaded_files
+    - a producer thread runs ``get_ee_tasks`` and puts each download parameter in the queue as soon as its URL exists
+    - a download pool downloads each image and puts the downloaded file in the queue
+    - the main thread dispatches the downloads and builds the VRT of a year as soon as all its images are downloaded
 
+    The status of each image is kept in the manifest of the job if provided. If the
+    buffers geometries are given, the close buffers are downloaded in shared regions and
+    a year is complete once the regions of all its buffers are downloaded.
 
-def create_vrt_per_year(downloaded_files, descriptions, tmp_dir):
+    Returns:
+        vrt_list: A dictionary mapping each year to its VRT file path.
+        satellites: A dictionary tracking the satellites used per year and buffer.
     """
-    Create a VRT file for each year by combining the downloaded TIFF files.
+    if not ee_buffers:
+        raise Exception("There are no geometries to download")
+
+    events = queue.Queue()
+    stop = threading.Event()
+    progress_lock = threading.Lock()
+
+    def on_task(year, cluster, params):
+        # stop requesting urls if the consumer has failed
+        if stop.is_set():
+            raise Exception("The image download has been interrupted")
+        events.put(("url", year, cluster, params))
+
+    def produce():
+        try:
+            _, satellites = get_ee_tasks(
+                mosaics,
+                ee_buffers,
+                descriptions,
+                sources,
+                bands,
+                tmp_dir,
+                output,
+                on_task=on_task,
+                progress_lock=progress_lock,
+                manifest=manifest,
+                native_crs=native_crs,
+                buffers=buffers,
+            )
+            events.put(("selected", satellites))
+        except Exception as e:
+            events.put(("error", e))
+
+    downloaded_files = {year: [] for year in mosaics}
+    downloaded_buffers = {year: 0 for year in mosaics}
+    vrt_list, satellites = {}, None
+
+    executor = concurrent.futures.ThreadPoolExecutor(cp.download_max_workers)
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    try:
+        while satellites is None or len(vrt_list) < len(mosaics):
+            event, *args = events.get()
+
+            if event == "error":
+                raise args[0]
+
+            elif event == "selected":
+                satellites = args[0]
+
+            elif event == "url":
+                year, cluster, params = args
+                future = executor.submit(download_image, params, progress_lock, output)
+                future.add_done_callback(
+                    lambda f, year=year, c=cluster: events.put(
+                        ("downloaded", year, c, f)
+                    )
+                )
+
+            elif event == "downloaded":
+                year, cluster, future = args
+                downloaded_files[year].append((cluster, future.result()))
+                downloaded_buffers[year] += len(cluster)
+
+                # the download of a region counts for each of its buffers
+                with progress_lock:
+                    for _ in cluster[1:]:
+                        output.update_progress()
+
+                if manifest:
+                    for j in cluster:
+                        manifest.set_status(f"gee/{year}/{j}", DOWNLOADED)
+
+                # build the vrt as soon as all the images of the year are there
+                # in a fixed order: the regions of the groups first and then the
+                # buffers so that a buffer is always drawn from its own image
+                if downloaded_buffers[year] == len(ee_buffers):
+                    files = sorted(
+                        downloaded_files[year], key=lambda f: (len(f[0]) == 1, f[0])
+                    )
+                    vrt_list[year] = create_vrt(
+                        [file for _, file in files],
+                        descriptions[year],
+                        tmp_dir,
+                        native_crs,
+                    )
+
+    except BaseException:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+
+    executor.shutdown()
+
+    # keep the years in the requested order
+    vrt_list = {year: vrt_list[year] for year in mosaics}
+
+    return vrt_list, satellites
+
+
+def create_vrt(
+    filepaths: List[Path],
+    description: str,
+    tmp_dir: Path,
+    native_crs: bool = cp.native_crs,
+) -> Path:
+    """
+    Create a VRT file by combining the downloaded TIFF files of a year.
 
     Args:
-        downloaded_files: A dictionary mapping each year to a list of downloaded file paths.
-        descriptions: A dictionary mapping each year to its base filename.
+        filepaths: the downloaded file paths.
+        description: the base filename of the year.
         tmp_dir: The temporary directory where files are stored.
+        native_crs: the files were requested on the EPSG:3857 grid of the job.
 
     Returns:
-        vrt_list: A dictionary mapping each year to its VRT file path.
+        vrt_path: the VRT file path.
     """
-    vrt_list = {}
-    for year, filepaths in downloaded_files.items():
-        # Ensure all file paths are strings
-        filepaths = [str(f) for f in filepaths]
+    # Ensure all file paths are strings
+    filepaths = [str(f) for f in filepaths]
 
-        # Define the VRT path using the descriptions to match the expected filenames
-        vrt_filename = f"{descriptions[year]}.vrt"
-        vrt_path = tmp_dir / vrt_filename
+    # Define the VRT path using the descriptions to match the expected filenames
+    vrt_path = tmp_dir / f"{description}.vrt"
 
-        # Build the VRT
-        ds = gdal.BuildVRT(str(vrt_path), filepaths)
+    # Build the VRT
+    # the EPSG:3857 grids of the satellites are nested, keep the finest one to never
+    # degrade a thumbnail
+    kwargs = {"resolution": "highest"} if native_crs else {}
+    ds = gdal.BuildVRT(str(vrt_path), filepaths, **kwargs)
 
-        # Check if the dataset was properly created
-        if ds is None:
-            raise Exception(f"Failed to create VRT for year {year}")
+    # Check if the dataset was properly created
+    if ds is None:
+        raise Exception(f"Failed to create VRT {vrt_path}")
 
-        ds = None  # Close the dataset
+    ds = None  # Close the dataset
 
-        # Ensure the VRT file exists
-        if not vrt_path.is_file():
-            raise Exception(f"The VRT {vrt_path} was not created")
+    # Ensure the VRT file exists
+    if not vrt_path.is_file():
+        raise Exception(f"The VRT {vrt_path} was not created")
 
-        vrt_list[year] = vrt_path
-    return vrt_list
+    return vrt_path
 
 
 def generate_title_list(mosaics, satellites, ee_buffers):
@@ -303,7 +712,7 @@ def download_image(params: Params, progress_lock=None, output=None):
     Download a single image and update progress.
 
     Args:
-        params: A dictionary containing 'link', 'description', 'tmp_dir'.
+        params: A dictionary containing 'link', 'description', 'tmp_dir' and 'cache_key'.
         progress_lock: A threading.Lock() instance for thread-safe progress updates.
         output: The output alert object to update progress.
 
@@ -315,21 +724,37 @@ def download_image(params: Params, progress_lock=None, output=None):
     description = params["description"]
     tmp_dir = params["tmp_dir"]
 
+    cache_key = params.get("cache_key")
+
     dst = tmp_dir / f"{description}.tif"
 
-    if not dst.is_file():
+    # look into the tile cache before downloading anything
+    in_cache = cache_key and tile_cache.get(cache_key, dst)
+
+    if not dst.is_file() and not in_cache:
         name = f"{description}_zipimage"
 
-        tmp = tmp_dir.joinpath(f"{name}.zip")
-        urlretrieve(link, tmp)
+        # stream the response to the disk with a fixed size buffer
+        tmp = tmp_dir.joinpath(f"{name}.part")
+        with urlopen(link) as response, tmp.open("wb") as f:
+            shutil.copyfileobj(response, f, cp.download_chunk_size)
+
+        # GeoTIFF are sent as is but multi-files payloads are still zipped
+        if zipfile.is_zipfile(tmp):
+            tmp_dst = dst.with_suffix(".tif.part")
+            with zipfile.ZipFile(tmp, "r") as zip_:
+                with zip_.open(zip_.namelist()[0]) as src, tmp_dst.open("wb") as f:
+                    shutil.copyfileobj(src, f, cp.download_chunk_size)
+
+            # Remove the zip file
+            tmp.unlink()
+            tmp = tmp_dst
 
-        # Unzip the file
-        with zipfile.ZipFile(tmp, "r") as zip_:
-            data = zip_.read(zip_.namelist()[0])
-            dst.write_bytes(data)
+        # only expose complete files to the next runs
+        tmp.replace(dst)
 
-        # Remove the zip file
-        tmp.unlink()
+        if cache_key:
+            tile_cache.put(cache_key, dst)
 
     # Update the output progress safely (if provided)
     if progress_lock and output:
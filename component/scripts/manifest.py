@@ -0,0 +1,82 @@
+import json
+import threading
+from pathlib import Path
+from typing import Optional
+
+from component import parameter as cp
+
+from .cache import get_cache_key
+
+PENDING = "pending"
+DOWNLOADED = "downloaded"
+RENDERED = "rendered"
+
+
+def get_job_dir(params: dict) -> Path:
+    """Return the durable folder of the job described by the parameters.
+
+    The same parameters always lead to the same folder so that an interrupted job can be resumed.
+    """
+    job_dir = cp.job_dir / get_cache_key(params)[:16]
+    job_dir.mkdir(exist_ok=True)
+
+    # keep a human readable version of the parameters next to the manifest
+    (job_dir / "params.json").write_text(json.dumps(params, indent=2, default=str))
+
+    return job_dir
+
+
+class JobManifest:
+    """Persisted status of the tasks of an export job.
+
+    Every status change is appended as a json line to ``manifest.jsonl`` in the job folder so that
+    updates are cheap even for thousands of tasks and a crash never corrupts the previous entries.
+    The last known status of each task is replayed when the manifest is loaded.
+    """
+
+    def __init__(self, job_dir: Path):
+        """
+        Args:
+            job_dir: the durable folder of the job
+        """
+        self.job_dir = Path(job_dir)
+        self.path = self.job_dir / "manifest.jsonl"
+        self.lock = threading.Lock()
+        self.tasks = {}
+
+        if self.path.is_file():
+            text = self.path.read_text()
+
+            # the last line may be truncated if the kernel died while writing it
+            if not text.endswith("\n"):
+                text = text[: text.rfind("\n") + 1]
+                self.path.write_text(text)
+
+            for line in text.splitlines():
+                entry = json.loads(line)
+                self.tasks[entry.pop("key")] = entry
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the last entry of a task, None if it was never registered."""
+
+        return self.tasks.get(key)
+
+    def status(self, key: str) -> Optional[str]:
+        """Return the status of a task (pending, downloaded or rendered)."""
+
+        return self.tasks.get(key, {}).get("status")
+
+    def set_status(self, key: str, status: str, **info) -> None:
+        """Update the status of a task and persist it.
+
+        Args:
+            key: the task identifier
+            status: the new status of the task
+            info: any json serializable information to keep with the task
+        """
+        entry = {**self.tasks.get(key, {}), **info, "status": status}
+
+        with self.lock:
+            self.tasks[key] = entry
+            with self.path.open("a") as f:
+                f.write(json.dumps({"key": key, **entry}, default=str) + "\n")
@@ -2,29 +2,43 @@
 import concurrent.futures
 import re
 import tempfile
-import threading
+from collections import Counter
 from datetime import datetime
-from functools import partial
 from itertools import product
 from pathlib import Path
-from typing import List
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
 import geopandas as gpd
 import numpy as np
+import pandas as pd
 import rasterio as rio
 import requests
 from osgeo import gdal
 from pyproj import CRS, Transformer
+from rasterio import warp
 from rasterio.warp import calculate_default_transform
-from sepal_ui.planetapi import PlanetModel
+from rasterio.windows import Window, from_bounds
 from shapely import geometry as sg
 from shapely.ops import unary_union
 
 from component import parameter as cp
-from component import widget as cw
 from component.message import cm
 
-from .utils import get_buffers, get_quad_dict, get_vrt_filename
+from . import planet_api
+from .cache import get_cache_key, tile_cache
+from .manifest import DOWNLOADED, PENDING, JobManifest
+from .utils import (
+    call_with_backoff,
+    get_buffers,
+    get_quad_dict,
+    get_vrt_filename,
+    is_rate_limit_error,
+)
+
+if TYPE_CHECKING:
+    from sepal_ui.planetapi import PlanetModel
+
+    from component import widget as cw
 
 # create the regex to match the different know planet datasets
 VISUAL = re.compile("^planet_medres_visual")  # will be removed from the selection
@@ -78,7 +92,7 @@ def get_mosaics(planet_model):
 
     # filter the mosaics in 3 groups
     bianual, monthly, other = [], [], []
-    for m in planet_model.get_mosaics():
+    for m in planet_api.get_mosaics(planet_api.get_api_key(planet_model)):
         name = m["name"]
         type_, short = mosaic_name(name)
 
@@ -100,7 +114,7 @@ def get_mosaics(planet_model):
     return res
 
 
-def get_planet_grid(squares: gpd.GeoSeries, out: cw.CustomAlert) -> gpd.GeoDataFrame:
+def get_planet_grid(squares: gpd.GeoSeries, out: "cw.CustomAlert") -> gpd.GeoDataFrame:
     """create a grid adapted to the points and to the planet initial grid."""
     out.add_msg(cm.planet.grid)
 
@@ -180,80 +194,165 @@ def get_planet_grid(squares: gpd.GeoSeries, out: cw.CustomAlert) -> gpd.GeoDataF
     return grid_gdf
 
 
+def plan_quads(
+    buffers: gpd.GeoSeries, planet_grid: gpd.GeoDataFrame
+) -> Tuple[List[str], Counter]:
+    """Compute the unique quads needed by the buffers.
+
+    Args:
+        buffers: the buffers of the points in EPSG:4326
+        planet_grid: the planet grid around the buffers (see get_planet_grid)
+
+    Returns:
+        the ids of the quads intersecting at least one buffer and the number of buffers
+        intersecting each of them
+    """
+    _, grid_index = planet_grid.sindex.query(
+        np.asarray(buffers), predicate="intersects"
+    )
+    names = get_quad_ids(planet_grid)
+    quad_ids = names[np.unique(grid_index)].tolist()
+    counts = Counter(names[grid_index].tolist())
+
+    return quad_ids, counts
+
+
+def get_quad_ids(planet_grid: gpd.GeoDataFrame) -> np.ndarray:
+    """Return the id of each quad of the grid."""
+
+    xy = zip(planet_grid.x, planet_grid.y)
+    return np.array([f"{int(x):04d}-{int(y):04d}" for x, y in xy])
+
+
+def get_quad_bounds(
+    buffers: gpd.GeoSeries, planet_grid: gpd.GeoDataFrame
+) -> Dict[str, tuple]:
+    """Compute the extent of the buffers needed in each quad.
+
+    Returns:
+        the (minx, miny, maxx, maxy) bounds in EPSG:4326 of the buffers intersecting
+        each quad, indexed by quad id
+    """
+    buffer_index, grid_index = planet_grid.sindex.query(
+        np.asarray(buffers), predicate="intersects"
+    )
+    bounds = pd.DataFrame(
+        buffers.bounds.to_numpy()[buffer_index],
+        columns=["minx", "miny", "maxx", "maxy"],
+    )
+    bounds["quad_id"] = get_quad_ids(planet_grid)[grid_index]
+    bounds = bounds.groupby("quad_id").agg(
+        {"minx": "min", "miny": "min", "maxx": "max", "maxy": "max"}
+    )
+
+    return {quad_id: tuple(row) for quad_id, row in bounds.iterrows()}
+
+
 def get_planet_vrt(
     geometry: gpd.GeoDataFrame,
     mosaics: List[str],
     image_size: int,
     filename: str,
     bands: str,
-    out: cw.CustomAlert,
+    out: "cw.CustomAlert",
     tmp_dir: Path,
-    planet_model: PlanetModel,
+    planet_model: "PlanetModel",
+    manifest: Optional[JobManifest] = None,
+    native_crs: bool = cp.native_crs,
 ):
+    """Download the quads of all the mosaics and gather them in one vrt per mosaic.
+
+    Each (mosaic, quad) pair is downloaded once even if it is used by several points.
+    The quads of all the mosaics share a single pool of cp.download_max_workers threads
+    and the vrt of a mosaic is built as soon as all its quads are there.
+    """
 
     filename = get_vrt_filename(filename, ["planet"], bands, image_size)
     buffers = get_buffers(gdf=geometry, size=image_size).geometry
     # find all the quads that should be downloaded and serve them as a grid
     planet_grid = get_planet_grid(buffers, out)
+    quad_ids, counts = plan_quads(buffers, planet_grid)
+    quad_bounds = get_quad_bounds(buffers, planet_grid) if cp.planet_crop_quads else {}
 
-    # create a vrt for each year
-    vrt_list = {}
-    nb_points = max(1, len(planet_grid))
-    total_img = len(mosaics) * nb_points
-    planet_model.get_mosaics()
-    out.reset_progress(total_img, "Progress")
-
-    # Create the quad id list
-    quad_ids = [
-        f"{int(row.x):04d}-{int(row.y):04d}" for _, row in planet_grid.iterrows()
-    ]
-
+    # describe all the quads at once and only keep the ones that exist in each mosaic
     quads_dict = get_quad_dict(planet_model, mosaics, quad_ids)
+    tasks = [
+        (mosaic, quad_id)
+        for mosaic, quads in quads_dict.items()
+        for quad_id, quad in quads.items()
+        if "download" in quad[0].get("_links", {})
+    ]
 
-    for mosaic in quads_dict:
-
-        quad_ids = quads_dict[mosaic].keys()
+    naive = sum(counts[quad_id] for _, quad_id in tasks)
+    out.add_msg(cm.planet.plan.format(len(tasks), naive))
+    out.reset_progress(max(1, len(tasks)), "Progress")
 
-        download_params = {
-            "filename": filename,
-            "mosaic_quads": quads_dict[mosaic],
-            "mosaic_name": mosaic,
-            "bands": bands,
-            "file_list": [],
-            "out": out,
-            "lock": threading.Lock(),
-            "tmp_dir": tmp_dir,
-        }
+    # keep track of the quads in the manifest of the job
+    if manifest:
+        for mosaic, quad_id in tasks:
+            key = f"planet/{mosaic}/{quad_id}"
+            if not manifest.get(key):
+                manifest.set_status(key, PENDING)
 
-        # download the images in parralel fashion
-        with concurrent.futures.ThreadPoolExecutor() as executor:
+    remaining = Counter(mosaic for mosaic, _ in tasks)
+    if not all(remaining[mosaic] for mosaic in quads_dict):
+        raise Exception("No image have been found on Planet lab servers")
 
-            futures = {
-                executor.submit(partial(get_quad, **download_params), quad_id): quad_id
-                for quad_id in quad_ids
-            }
+    # download every quad in a single bounded pool
+    files = {mosaic: {} for mosaic in quads_dict}
+    vrt_list = {}
+    session = planet_api.get_session(planet_api.get_api_key(planet_model))
+    with concurrent.futures.ThreadPoolExecutor(cp.download_max_workers) as executor:
+
+        futures = {}
+        for mosaic, quad_id in tasks:
+            future = executor.submit(
+                get_quad,
+                quad_id=quad_id,
+                filename=filename,
+                mosaic_quads=quads_dict[mosaic],
+                mosaic_name=mosaic,
+                bands=bands,
+                out=out,
+                tmp_dir=tmp_dir,
+                native_crs=native_crs,
+                session=session,
+                bounds=quad_bounds.get(quad_id),
+            )
+            futures[future] = (mosaic, quad_id)
 
-            # Check if any future has raised an exception
+        try:
             for future in concurrent.futures.as_completed(futures):
-                e = future.exception()
-                if e:
-                    raise e  # Rethrow the first exception encountered
-
-        file_list = download_params["file_list"]
-        print("###FILE LIST", file_list)
-        if file_list == []:
-            raise Exception("No image have been found on Planet lab servers")
-
-        # create a vrt out of it
-        vrt_path = tmp_dir / f"{filename}_{mosaic}.vrt"
-        ds = gdal.BuildVRT(str(vrt_path), file_list)
-        ds.FlushCache()
-
-        # check that the file was effectively created (gdal doesn't raise errors)
-        if not vrt_path.is_file():
-            raise Exception(f"the vrt {vrt_path} was not created")
+                mosaic, quad_id = futures[future]
+                files[mosaic][quad_id] = future.result()
+
+                if manifest:
+                    key = f"planet/{mosaic}/{quad_id}"
+                    manifest.set_status(key, DOWNLOADED)
+
+                # create a vrt as soon as all the quads of the mosaic are there
+                remaining[mosaic] -= 1
+                if not remaining[mosaic]:
+                    file_list = [
+                        str(files[mosaic][q]) for q in quad_ids if q in files[mosaic]
+                    ]
+                    vrt_list[mosaic] = create_planet_vrt(
+                        file_list, tmp_dir / f"{filename}_{mosaic}.vrt"
+                    )
+
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    size = sum(f.stat().st_size for quads in files.values() for f in quads.values())
+    saved = naive - len(tasks)
+    out.add_msg(
+        cm.planet.saved.format(saved, saved * size / max(1, len(tasks)) / 1024**2)
+    )
 
-        vrt_list[mosaic] = vrt_path
+    # keep the mosaics in the requested order
+    vrt_list = {m: vrt_list[m] for m in quads_dict}
 
     # create a title list to be consistent
     title_list = {
@@ -263,72 +362,166 @@ def get_planet_vrt(
     return vrt_list, title_list
 
 
+def create_planet_vrt(file_list: List[str], vrt_path: Path) -> Path:
+    """Create the vrt of a mosaic from its quads files."""
+
+    ds = gdal.BuildVRT(str(vrt_path), file_list)
+    ds.FlushCache()
+
+    # check that the file was effectively created (gdal doesn't raise errors)
+    if not vrt_path.is_file():
+        raise Exception(f"the vrt {vrt_path} was not created")
+
+    return vrt_path
+
+
+class IncompleteDownloadError(Exception):
+    """Raised when a download ends before the announced Content-Length."""
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Check if a download failed for a reason that may not happen again."""
+
+    transient = (
+        requests.ConnectionError,
+        requests.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+        IncompleteDownloadError,
+    )
+    return isinstance(error, transient) or is_rate_limit_error(error)
+
+
+def _stream_to_file(session: requests.Session, url: str, dst: Path) -> Path:
+    """Stream a single response to the disk by chunks and check its length."""
+
+    with session.get(url, stream=True, timeout=cp.planet_timeout) as r:
+        r.raise_for_status()
+
+        with dst.open("wb") as f:
+            for chunk in r.iter_content(cp.download_chunk_size):
+                f.write(chunk)
+
+        # the raw stream counts the bytes sent by the server, even if they are encoded
+        expected = r.headers.get("Content-Length")
+        if expected is not None and r.raw.tell() != int(expected):
+            raise IncompleteDownloadError(
+                f"{url} ended after {r.raw.tell()} of {expected} bytes"
+            )
+
+    return dst
+
+
+def download_file(session: requests.Session, url: str, dst: Path) -> Path:
+    """Download a file without holding it in memory.
+
+    The response is written by chunks of cp.download_chunk_size bytes and the download
+    is started again with an exponential backoff if the connection fails or ends early.
+    """
+    return call_with_backoff(
+        _stream_to_file,
+        session,
+        url,
+        dst,
+        max_retries=cp.planet_max_retries,
+        backoff=cp.planet_backoff_factor,
+        retry_on=is_transient_error,
+    )
+
+
 def get_quad(
     quad_id: str,
     filename: str,
     mosaic_quads: dict,
     mosaic_name: str,
     bands,
-    file_list,
     out,
-    lock=None,
+    session: requests.Session,
     tmp_dir: Path = Path(tempfile.mkdtemp()),
+    native_crs: bool = cp.native_crs,
+    bounds: Optional[tuple] = None,
 ):
-    """get one single quad from parameters."""
+    """get one single quad from parameters.
+
+    With native_crs the quad is kept in its native EPSG:3857 projection, the display
+    projection of the thumbnails. The quad is streamed to the disk through the session
+    of the API key shared by all the download threads (see download_file), the download
+    links of the quads don't carry the key. If the bounds (in EPSG:4326) of the buffers
+    are given, only this window of the quad is read and written.
+    """
     # check file existence
     file = tmp_dir / f"{filename}_{mosaic_name}_{quad_id}.tif"
     print("###PROCESSING FILE", file)
 
-    if file.is_file():
-        if lock:
-            with lock:
-                file_list.append(str(file))
+    # look into the tile cache before downloading anything
+    crs = ["EPSG:3857"] if native_crs else []
+    crop = [[round(b, 6) for b in bounds]] if bounds else []
+    cache_key = get_cache_key("planet", mosaic_name, quad_id, bands, *crs, *crop)
+    in_cache = tile_cache.get(cache_key, file)
 
-    else:
+    if not (file.is_file() or in_cache):
 
         tmp_file = file.with_stem(file.stem + "_tmp")
+        quad = mosaic_quads[quad_id][0]
 
-        # to avoid the downloading of non existing quads
-        try:
-            # quad = planet_model.get_quad(mosaic, quad_id)
-            quad = mosaic_quads[quad_id][0]
-            file_list.append(str(file))
-        except Exception as e:
-            raise e
-            out.add_msg(f"{e}", "error")
-            return
-
-        r = requests.get(quad["_links"]["download"])
-        tmp_file.write_bytes(r.content)
+        download_file(session, quad["_links"]["download"], tmp_file)
 
         with rio.open(tmp_file) as src:
 
-            # adapt the file to only keep the 3 required bands
-            data = src.read(cp.planet_bands_combo[bands])
+            # only read the part of the quad covered by the buffers, with a margin of
+            # one pixel for the rounding of the windows read in the thumbnails
+            window = Window(0, 0, src.width, src.height)
+            if bounds:
+                src_bounds = warp.transform_bounds("EPSG:4326", src.crs, *bounds)
+                crop_window = from_bounds(*src_bounds, src.transform)
+                crop_window = crop_window.round_offsets().round_lengths()
+                col, row = crop_window.col_off - 1, crop_window.row_off - 1
+                crop_window = Window(
+                    col, row, crop_window.width + 2, crop_window.height + 2
+                )
+                window = window.intersection(crop_window)
 
-            # reproject the image in EPSG:4326
-            dst_crs = "EPSG:4326"
-            transform, width, height = calculate_default_transform(
-                src.crs, dst_crs, src.width, src.height, *src.bounds
-            )
+            # adapt the file to only keep the 3 required bands
+            data = src.read(cp.planet_bands_combo[bands], window=window)
 
             kwargs = src.meta.copy()
             kwargs.update(
-                {
-                    "count": 3,
-                    "crs": dst_crs,
-                    "transform": transform,
-                    "width": width,
-                    "height": height,
-                }
+                count=3,
+                width=window.width,
+                height=window.height,
+                transform=src.window_transform(window),
+                **cp.planet_gtiff_options,
             )
 
-            with rio.open(file, "w", **kwargs) as dst:
+            # reproject the image in EPSG:4326
+            if not native_crs:
+                dst_crs = "EPSG:4326"
+                transform, width, height = calculate_default_transform(
+                    src.crs,
+                    dst_crs,
+                    window.width,
+                    window.height,
+                    *src.window_bounds(window),
+                )
+                kwargs.update(
+                    {
+                        "crs": dst_crs,
+                        "transform": transform,
+                        "width": width,
+                        "height": height,
+                    }
+                )
+
+            # only expose complete files to the next runs
+            tmp_dst = file.with_stem(file.stem + "_part")
+            with rio.open(tmp_dst, "w", **kwargs) as dst:
                 dst.write(data)
+            tmp_dst.replace(file)
 
         # remove the tmp file
         tmp_file.unlink()
 
+        tile_cache.put(cache_key, file)
+
     # update the loading bar
     out.update_progress()
 
@@ -0,0 +1,225 @@
+"""Light client of the Planet basemaps API used to describe the mosaics and their quads.
+
+The requests are sent through a single ``requests.Session`` per API key so that every
+thread reuses the same pool of connections instead of opening a new TLS connection for
+each quad. The descriptions are kept in a persistent cache for ``cp.planet_cache_ttl``
+seconds so that running the same points again skips the metadata requests. Only the
+fields used by the application are kept and the ``api_key`` parameters are removed from
+the links as the session already sends the key.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+from component import parameter as cp
+
+from .cache import get_cache_key
+
+MOSAICS_URL = "https://api.planet.com/basemaps/v1/mosaics"
+QUAD_URL = MOSAICS_URL + "/{}/quads/{}"
+
+
+class MetadataCache:
+    """On-disk cache of json responses that expire after a fixed time.
+
+    The responses are stored as ``<cache_dir>/<key[:2]>/<key>.json``. Writes are atomic
+    (write a temporary file and rename) so concurrent threads or processes never read a
+    partial response. The modification time of the files is used as the creation date.
+    The files are only readable by the user.
+    """
+
+    def __init__(
+        self, cache_dir: Path = cp.metadata_dir, ttl: float = cp.planet_cache_ttl
+    ):
+        """
+        Args:
+            cache_dir: the folder where the responses are stored
+            ttl: the number of seconds a response is valid, 0 to disable the cache
+        """
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+
+    def path(self, key: str) -> Path:
+        """Return the path of a response in the cache."""
+
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached response, None if it is missing or expired."""
+
+        if not self.ttl:
+            return None
+
+        file = self.path(key)
+        try:
+            if time.time() - file.stat().st_mtime > self.ttl:
+                return None
+            return json.loads(file.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, key: str, value: Any) -> None:
+        """Store a response in the cache."""
+
+        if not self.ttl:
+            return
+
+        dst = self.path(key)
+        dst.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+        fd, tmp = tempfile.mkstemp(dir=dst.parent, suffix=".part")
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp, dst)
+
+
+# the cache shared by all the exports
+metadata_cache = MetadataCache()
+
+# the sessions of each API key
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def strip_api_key(url: str) -> str:
+    """Remove the api_key query parameter of a Planet url."""
+
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    query = [(k, v) for k, v in query if k != "api_key"]
+
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def describe_mosaic(mosaic: dict) -> dict:
+    """Keep the fields of a mosaic used by the application."""
+
+    return {k: mosaic[k] for k in ("id", "name", "bbox") if k in mosaic}
+
+
+def describe_quad(quad: dict) -> dict:
+    """Keep the fields of a quad used by the application, without the API key."""
+
+    description = {k: quad[k] for k in ("id", "bbox") if k in quad}
+    links = quad.get("_links", {})
+    if "download" in links:
+        description["_links"] = {"download": strip_api_key(links["download"])}
+
+    return description
+
+
+def get_api_key(planet_model) -> str:
+    """Return the API key of an authenticated PlanetModel.
+
+    ``PlanetModel.credentials`` is deprecated, the key is read from the auth of the model.
+    """
+    return planet_model.auth._key
+
+
+def get_session(api_key: str) -> requests.Session:
+    """Return the session shared by all the threads using this API key.
+
+    The connection pool is large enough for every metadata and download thread and the
+    transient errors (rate limits and server errors) are retried with an exponential
+    backoff.
+    """
+    with _sessions_lock:
+        if api_key not in _sessions:
+            pool_size = max(cp.planet_max_workers, cp.download_max_workers)
+            retries = Retry(
+                total=cp.planet_max_retries,
+                backoff_factor=cp.planet_backoff_factor,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=["GET"],
+            )
+            adapter = HTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries
+            )
+
+            session = requests.Session()
+            session.auth = (api_key, "")
+            session.mount("https://", adapter)
+            _sessions[api_key] = session
+
+    return _sessions[api_key]
+
+
+def get_mosaics(api_key: str) -> List[dict]:
+    """Return the description of all the mosaics available to the API key."""
+
+    # the available mosaics depend on the subscriptions of the key
+    key = get_cache_key("planet", "mosaics", api_key)
+    mosaics = metadata_cache.get(key)
+    if mosaics is not None:
+        return mosaics
+
+    session = get_session(api_key)
+
+    # follow the pagination of the API
+    mosaics, url = [], MOSAICS_URL
+    while url:
+        r = session.get(url, timeout=cp.planet_timeout)
+        r.raise_for_status()
+        page = r.json()
+        mosaics += [describe_mosaic(m) for m in page.get("mosaics", [])]
+        url = page.get("_links", {}).get("_next")
+
+    metadata_cache.put(key, mosaics)
+
+    return mosaics
+
+
+def get_quad(api_key: str, mosaic: dict, quad_id: str) -> dict:
+    """Return the description of a quad, an empty dict if it is not in the mosaic."""
+
+    key = get_cache_key("planet", "quad", api_key, mosaic["id"], quad_id)
+    quad = metadata_cache.get(key)
+    if quad is not None:
+        return quad
+
+    session = get_session(api_key)
+    r = session.get(QUAD_URL.format(mosaic["id"], quad_id), timeout=cp.planet_timeout)
+    if r.status_code == 404:
+        quad = {}
+    else:
+        r.raise_for_status()
+        quad = describe_quad(r.json())
+
+    metadata_cache.put(key, quad)
+
+    return quad
+
+
+def get_quads(
+    api_key: str,
+    mosaics: List[dict],
+    quad_ids: List[str],
+    max_workers: int = cp.planet_max_workers,
+) -> Dict[str, Dict[str, dict]]:
+    """Describe the quads of every mosaic concurrently.
+
+    Returns:
+        the description of each quad indexed by mosaic name and quad id
+    """
+    pairs = [(m, q) for m in mosaics for q in quad_ids]
+
+    with ThreadPoolExecutor(max_workers) as executor:
+        quads = executor.map(lambda pair: get_quad(api_key, *pair), pairs)
+
+        quads_dict = {}
+        for (mosaic, quad_id), quad in zip(pairs, quads):
+            quads_dict.setdefault(mosaic["name"], {})[quad_id] = quad
+
+    return quads_dict
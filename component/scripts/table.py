@@ -1,13 +1,14 @@
 import shutil
+from typing import TYPE_CHECKING
 
-from ipyleaflet import AwesomeIcon, GeoJSON, Marker, MarkerCluster
-from ipywidgets import HTML
 from sepal_ui import color
-from sepal_ui import mapping as sm
 
 from component import parameter as cp
 from component.message import cm
 
+if TYPE_CHECKING:
+    from sepal_ui import mapping as sm
+
 STYLE = {
     "stroke": True,
     "color": color.secondary,
@@ -18,11 +19,16 @@ STYLE = {
     "fillOpacity": 0.4,
 }
 
-ICON = AwesomeIcon(name="", icon_color="white", marker_color="darkblue")
-
 
-def setMap(model, m: sm.SepalMap):
+def setMap(model, m: "sm.SepalMap"):
     """create a map and a df list of points."""
+    # the map widgets are only loaded when needed to keep the scripts importable
+    # without the display stack (e.g. from the command line)
+    from ipyleaflet import AwesomeIcon, GeoJSON, Marker, MarkerCluster
+    from ipywidgets import HTML
+
+    icon = AwesomeIcon(name="", icon_color="white", marker_color="darkblue")
+
     # empty the map
     m.remove_all()
 
@@ -35,7 +41,7 @@ def setMap(model, m: sm.SepalMap):
 
             msg = HTML(value=f"id: {row.id}")
             marker = Marker(
-                icon=ICON, popup=msg, location=(row.lat, row.lng), draggable=False
+                icon=icon, popup=msg, location=(row.lat, row.lng), draggable=False
             )
             markers.append(marker)
 
@@ -1,21 +1,38 @@
+import os
+import random
 import shutil
+import threading
 import time
+import warnings
+from collections import OrderedDict
 from math import sqrt
 from pathlib import Path
-from typing import List, Union
+from typing import Callable, List, Optional, Tuple, Union
 
 import ee
 import geopandas as gpd
 import numpy as np
+import pandas as pd
 import rasterio as rio
+import shapely
+from osgeo import gdal
 from rasterio import warp
 from rasterio.crs import CRS
 from rasterio.windows import from_bounds
 from skimage import exposure, img_as_float
 
+from component import parameter as cp
 from component.parameter.directory import result_dir
 from component.typings.custom_types import AdjustmentType
 
+from . import planet_api
+
+# opencv is an optional dependency used for a faster adaptive equalization
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
 
 def min_diagonal(polygon, square_size):
     """
@@ -31,9 +48,15 @@ def min_diagonal(polygon, square_size):
     return max(square_size, sqrt((maxx - minx) ** 2 + (maxy - miny) ** 2))
 
 
-def get_pdf_path(
-    folder_name: str, sources: list, bands: str, image_size: int, enhance_method: str
-):
+def get_output_path(
+    folder_name: str,
+    sources: list,
+    bands: str,
+    image_size: int,
+    enhance_method: str,
+    format: str = "pdf",
+) -> Path:
+    """Return the pdf file or the folder of the per point images of the other formats."""
 
     output_folder = result_dir / folder_name
     output_folder.mkdir(exist_ok=True)
@@ -41,11 +64,19 @@ def get_pdf_path(
     # Create a pdf file path with sensors and bands
     sensors = "_".join(sources) if len(sources) else "planet"
     str_bands = "_".join(bands.split(", "))
+    name = f"{folder_name}_{sensors}_{str_bands}_{enhance_method}_size{image_size}"
 
-    return (
-        output_folder
-        / f"{folder_name}_{sensors}_{str_bands}_{enhance_method}_size{image_size}.pdf"
-    )
+    if format == "pdf":
+        return output_folder / f"{name}.pdf"
+
+    return output_folder / f"{name}_{format}"
+
+
+def get_pdf_path(
+    folder_name: str, sources: list, bands: str, image_size: int, enhance_method: str
+):
+
+    return get_output_path(folder_name, sources, bands, image_size, enhance_method)
 
 
 def get_vrt_filename(folder_name: str, sources: list, bands: str, image_size: int):
@@ -80,12 +111,7 @@ def enhance_band(band: np.array, adjustment_type: AdjustmentType) -> np.array:
     band[np.isnan(band)] = np.min(band)
 
     if adjustment_type == "histogram_equalization":
-        h, bin_edges = np.histogram(band.flatten(), bins=3000, density=True)
-        cdf = h.cumsum()
-        cdf_normalized = cdf / cdf[-1]  # Normalize CDF
-        data = np.interp(band.flatten(), bin_edges[:-1], cdf_normalized).reshape(
-            band.shape
-        )
+        data = equalize_hist(band).astype(band.dtype)
 
     elif adjustment_type == "contrast_stretching":
         p2, p98 = np.percentile(band, (2, 98))
@@ -116,88 +142,552 @@ def enhance_band(band: np.array, adjustment_type: AdjustmentType) -> np.array:
     return (data - np.min(data)) / (np.max(data) - np.min(data))
 
 
+def equalize_hist(band: np.ndarray) -> np.ndarray:
+    """Equalize the histogram of a band.
+
+    Each value is mapped to the fraction of the pixels lower or equal to it (the exact
+    cumulative distribution). Integer bands use a lookup table over their range of
+    values, float bands use the ranks of the values in the sorted band. The result is
+    normalized to [0, 1].
+
+    It replaces the interpolation of a 3000 bins histogram computed on float64 copies.
+
+    Args:
+        band: the band, usually (H, W)
+
+    Returns:
+        the equalized band as float32
+    """
+    n = band.size
+
+    if band.dtype.kind in "ui" and int(band.max()) - int(band.min()) < 2**16:
+        # lookup table of the cumulative distribution over the values of the band
+        # in a signed index type as the span of a signed band may not fit in its dtype
+        index = band.astype(np.intp) - int(band.min())
+        cdf = np.cumsum(np.bincount(index.ravel(), minlength=1), dtype=np.float32)
+        cdf /= n
+        data = cdf[index]
+
+    else:
+        # Handle NaN values by replacing them with the minimum
+        nan = np.isnan(band)
+        if nan.any():
+            band = np.where(nan, np.nanmin(band), band)
+
+        # rank of each value in the sorted band, equal values share the rank of
+        # the last of them (side="right" of np.searchsorted)
+        order = np.argsort(band, axis=None)
+        sorted_band = band.ravel()[order]
+        last = np.append(np.flatnonzero(sorted_band[1:] != sorted_band[:-1]), n - 1)
+        ranks = np.repeat(last + 1, np.diff(last, prepend=-1)).astype(np.float32)
+
+        data = np.empty(n, dtype=np.float32)
+        data[order] = ranks / n
+        data = data.reshape(band.shape)
+
+    # the lowest value is mapped to its own frequency, bring it back to 0
+    low = data.min()
+    data -= low
+    data /= (1 - low) if low < 1 else 1
+
+    return data
+
+
+# CLAHE objects of the current thread, created once for the whole export
+_clahe = threading.local()
+
+
+def equalize_adapthist(band: np.ndarray, backend: str = cp.clahe_backend) -> np.ndarray:
+    """Apply a contrast limited adaptive histogram equalization (CLAHE) to a band.
+
+    OpenCV's implementation is much faster than the skimage one, it is used when it is
+    installed with the same parameters: 8x8 tiles, 256 bins and the same clip limit
+    (opencv expresses it relatively to the average number of pixels per bin).
+
+    Args:
+        band: the (H, W) band in [0, 1]
+        backend: "opencv", "skimage" or "auto" to use opencv when it is installed
+
+    Returns:
+        the equalized band
+    """
+    if backend == "auto":
+        backend = "skimage" if cv2 is None else "opencv"
+
+    if backend == "skimage":
+        return exposure.equalize_adapthist(band, clip_limit=cp.clahe_clip_limit)
+
+    if cv2 is None:
+        raise ImportError("opencv is required to use the opencv CLAHE backend")
+
+    # opencv objects are not thread-safe, each thread keeps its own
+    if not hasattr(_clahe, "clahe"):
+        _clahe.clahe = cv2.createCLAHE(
+            clipLimit=cp.clahe_clip_limit * 256, tileGridSize=(8, 8)
+        )
+
+    data = _clahe.clahe.apply(np.round(band * 255).astype(np.uint8))
+
+    return data.astype(np.float32) / 255
+
+
+# the methods that only need the limits of each band to be applied
+STRETCH_METHODS = [
+    "min_max",
+    "standard_deviation",
+    "contrast_stretching",
+    "percent_clip",
+]
+
+
+class StretchAccumulator:
+    """Streaming statistics of the bands of several images to stretch them the same way.
+
+    The minimum and maximum of each band are exact, the percentiles are estimated on a
+    uniform random sample of at most ``sample_size`` pixels per band. The sample is kept
+    with random keys (the pixels with the smallest keys among all the pixels seen) so
+    the images can be added one by one without keeping them in memory.
+    """
+
+    def __init__(self, sample_size: int = cp.stretch_sample_size, seed: int = 0):
+        """
+        Args:
+            sample_size: the maximum number of pixels kept per band
+            seed: the seed of the random sample
+        """
+        self.sample_size = sample_size
+        self.rng = np.random.default_rng(seed)
+        self.min = self.max = None
+        self.keys, self.values = None, None
+
+    def update(self, data: np.ndarray) -> None:
+        """Add the (bands, H, W) image to the statistics."""
+
+        bands = data.reshape(data.shape[0], -1).astype(np.float32)
+
+        # the empty bands of an image are ignored
+        with np.errstate(invalid="ignore"), warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            min_val, max_val = np.nanmin(bands, axis=1), np.nanmax(bands, axis=1)
+
+        if self.min is None:
+            self.min, self.max = min_val, max_val
+            self.keys = [np.empty(0, np.float32) for _ in bands]
+            self.values = [np.empty(0, np.float32) for _ in bands]
+        else:
+            self.min = np.fmin(self.min, min_val)
+            self.max = np.fmax(self.max, max_val)
+
+        for i, band in enumerate(bands):
+            band = band[~np.isnan(band)]
+            keys = np.concatenate(
+                [self.keys[i], self.rng.random(band.size, np.float32)]
+            )
+            values = np.concatenate([self.values[i], band])
+            if keys.size > self.sample_size:
+                keep = np.argpartition(keys, self.sample_size)[: self.sample_size]
+                keys, values = keys[keep], values[keep]
+            self.keys[i], self.values[i] = keys, values
+
+    def limits(self, adjustment_type: AdjustmentType) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the (low, high) limits of each band for the adjustment, shaped (bands, 1, 1)."""
+
+        if adjustment_type in ["min_max", "standard_deviation"]:
+            low, high = self.min, self.max
+        elif adjustment_type in ["contrast_stretching", "percent_clip"]:
+            q = (2, 98) if adjustment_type == "contrast_stretching" else (1, 99)
+            low, high = np.array([np.percentile(v, q) for v in self.values]).T
+        else:
+            raise ValueError(f"{adjustment_type} cannot be shared between images")
+
+        return (
+            low.astype(np.float32).reshape(-1, 1, 1),
+            high.astype(np.float32).reshape(-1, 1, 1),
+        )
+
+
+def enhance_bands(
+    data: np.ndarray,
+    adjustment_type: AdjustmentType,
+    limits: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+) -> np.ndarray:
+    """Apply the adjustment of ``enhance_band`` to every band of an image at once.
+
+    The statistics of each band are computed with single reductions over the last 2 axes
+    so the function works on a single image (bands, H, W) as well as on a stack of
+    images of the same size (N, bands, H, W). The computation is done in place on a
+    float32 copy of the data and the methods that already end in [0, 1] skip the final
+    normalization.
+
+    Args:
+        data: the bands of the image(s), the last 2 axes being the rows and the columns
+        adjustment_type: the type of contrast adjustment to apply
+        limits: the (low, high) limits of each band shared with other images (see
+            StretchAccumulator), only used by the STRETCH_METHODS
+
+    Returns:
+        the enhanced bands in [0, 1] as float32, with the same shape as data
+    """
+    axis = (-2, -1)
+
+    # apply the limits shared with the other images
+    # nan are replaced by the low limit like they are replaced by the minimum below
+    if limits is not None and adjustment_type in STRETCH_METHODS:
+        low, high = limits
+        band = data.astype(np.float32, copy=True)
+        band = np.where(np.isnan(band), low, band)
+        np.clip(band, low, high, out=band)
+        band -= low
+        band /= np.where(high > low, high - low, 1)
+        return band
+
+    # the equalization is computed on the native values of the bands
+    if adjustment_type == "histogram_equalization":
+        bands = data.reshape(-1, *data.shape[-2:])
+        band = np.empty(bands.shape, dtype=np.float32)
+        for i, b in enumerate(bands):
+            band[i] = equalize_hist(b)
+        return band.reshape(data.shape)
+
+    # every method is invariant to an affine rescaling of the band so the data don't
+    # need to be scaled to [0, 1] first like img_as_float does
+    band = data.astype(np.float32, copy=True)
+
+    # Handle NaN values by replacing them with the minimum
+    min_val = np.nanmin(band, axis=axis, keepdims=True)
+    nan = np.isnan(band)
+    if nan.any():
+        band[nan] = np.broadcast_to(min_val, band.shape)[nan]
+
+    def normalize(band, low, high):
+        """Rescale the band from [low, high] to [0, 1] in place."""
+        band -= low
+        band /= np.where(high > low, high - low, 1)
+        return band
+
+    if adjustment_type in ["min_max", "standard_deviation"]:
+        # the standard deviation normalization is an affine transformation so
+        # once normalized to [0, 1] it gives the same result as min_max
+        max_val = np.max(band, axis=axis, keepdims=True)
+        return normalize(band, min_val, max_val)
+
+    elif adjustment_type in ["contrast_stretching", "percent_clip"]:
+        q = (2, 98) if adjustment_type == "contrast_stretching" else (1, 99)
+        low, high = np.percentile(band, q, axis=axis, keepdims=True).astype(band.dtype)
+        np.clip(band, low, high, out=band)
+        return normalize(band, low, high)
+
+    elif adjustment_type == "adaptive_equalization":
+        # the method needs the whole distribution of each band, it is applied
+        # band by band on the min_max normalized data
+        max_val = np.max(band, axis=axis, keepdims=True)
+        band = normalize(band, min_val, max_val)
+        bands = band.reshape(-1, *band.shape[-2:])
+        for i, b in enumerate(bands):
+            b = equalize_adapthist(b)
+
+            # Ensure all data is normalized to [0, 1]
+            bands[i] = normalize(b, b.min(), b.max())
+
+        return band
+
+    else:
+        raise ValueError("Unsupported adjustment type")
+
+
+# buffers already computed in this session, indexed by the content of the geometries
+_buffers_cache = OrderedDict()
+
+
 def get_buffers(
     gdf: gpd.GeoDataFrame, size: int, gee: bool = False
 ) -> Union[gpd.GeoDataFrame, List[ee.Geometry]]:
-    """Get the buffers of the geometries in the gdf."""
+    """Get the buffers of the geometries in the gdf.
 
-    geometry = gdf.copy()
+    The buffer of each geometry is a square centered on its centroid (in EPSG:3857) with
+    a side of at least size and large enough to contain the geometry. All the squares
+    are built in one vectorized call and the result is memoized for the (geometry, size)
+    pair as the same buffers are needed by every step of an export.
+    """
+    key = (
+        pd.util.hash_pandas_object(gdf.to_wkb(), index=True).values.tobytes(),
+        str(gdf.crs),
+        size,
+        gee,
+    )
+    if key in _buffers_cache:
+        _buffers_cache.move_to_end(key)
+        buffers = _buffers_cache[key]
+        return list(buffers) if gee else buffers.copy()
 
     # Reproject to a projected CRS before computing centroids
-    geometry_projected = geometry.to_crs(3857)
+    buffers = gdf.to_crs(3857)
+    geoms = np.asarray(buffers.geometry)
+
+    # the side of the squares is the diagonal of the geometry bounds or the size
+    minx, miny, maxx, maxy = shapely.bounds(geoms).T
+    half = np.maximum(size, np.hypot(maxx - minx, maxy - miny)) / 2
+
+    # the squares have the same vertices (in the same order) as a square cap buffer
+    # of the centroid
+    centroids = shapely.centroid(geoms)
+    x, y = shapely.get_x(centroids), shapely.get_y(centroids)
+    xs = np.stack([x + half, x + half, x - half, x - half, x + half], axis=1)
+    ys = np.stack([y + half, y - half, y - half, y + half, y + half], axis=1)
+    squares = shapely.polygons(np.stack([xs, ys], axis=-1))
+
+    buffers.geometry = gpd.GeoSeries(squares, index=buffers.index, crs=3857)
+    buffers = buffers.to_crs(4326)
 
-    # extract the points coordinates
-    pts = geometry_projected.copy()
-    pts.geometry = pts.geometry.centroid
+    if gee:
+        coords = shapely.get_coordinates(np.asarray(buffers.geometry))
+        buffers = [ee.Geometry.Polygon([r.tolist()]) for r in coords.reshape(-1, 5, 2)]
 
-    # build the size dictionary
-    size_dict = {
-        row.id: min_diagonal(row.geometry, size)
-        for _, row in geometry_projected.iterrows()
-    }
+    _buffers_cache[key] = buffers
+    if len(_buffers_cache) > cp.buffers_cache_size:
+        _buffers_cache.popitem(last=False)
 
-    # create the buffer grid
-    buffers = pts
-    buffers.geometry = buffers.apply(
-        lambda r: r.geometry.buffer(size_dict[r.id] / 2, cap_style=3), axis=1
-    )
-    buffers = buffers.to_crs(4326)
+    return list(buffers) if gee else buffers.copy()
 
-    if gee:
-        buffers = [
-            ee.Geometry.Polygon(row.geometry.__geo_interface__["coordinates"])
-            for _, row in buffers.iterrows()
-        ]
 
-    return buffers
+class DatasetPool:
+    """Bounded LRU pool of opened rasterio datasets.
+
+    Opening a VRT parses its XML and touches every source file it lists, the pool keeps
+    the datasets open for the whole export instead of opening them for every point.
+    rasterio datasets cannot be shared between threads or processes so each thread gets
+    its own pool and a forked process never reuses the handles of its parent.
+    """
+
+    def __init__(self, max_size: int = cp.dataset_pool_size):
+        """
+        Args:
+            max_size: the maximum number of datasets kept open by each thread
+        """
+        self.max_size = max_size
+        self.pid = os.getpid()
+        self.local = threading.local()
+        self.pools = []
+        self.lock = threading.Lock()
+
+    def _pool(self) -> OrderedDict:
+        """Return the pool of the current thread."""
+
+        # forget the handles inherited from the parent process
+        if os.getpid() != self.pid:
+            self.pid = os.getpid()
+            self.local = threading.local()
+            self.pools = []
+            self.lock = threading.Lock()
+
+        if not hasattr(self.local, "datasets"):
+            self.local.datasets = OrderedDict()
+            with self.lock:
+                self.pools.append(self.local.datasets)
+
+        return self.local.datasets
+
+    def open(self, image_path: Union[str, Path]) -> rio.DatasetReader:
+        """Return an opened dataset of the image, the dataset must not be closed by the caller."""
+
+        # the modification time is part of the key to never read an outdated file
+        path = Path(image_path)
+        key = (str(path.resolve()), path.stat().st_mtime_ns)
+
+        datasets = self._pool()
+        if key in datasets:
+            datasets.move_to_end(key)
+            return datasets[key]
+
+        datasets[key] = rio.open(path)
+        while len(datasets) > self.max_size:
+            _, dataset = datasets.popitem(last=False)
+            dataset.close()
+
+        return datasets[key]
+
+    def close(self):
+        """Close all the datasets of the current process."""
+
+        with self.lock:
+            for datasets in self.pools:
+                while datasets:
+                    _, dataset = datasets.popitem()
+                    dataset.close()
+
+
+dataset_pool = DatasetPool()
+
+
+def get_gdal_cache_size(image_files: list, image_size: int, max_workers: int) -> int:
+    """Size the GDAL block cache of each process to the job.
+
+    The cache should hold the blocks read for a point in every image and the blocks
+    shared with the neighbouring points, without using more than a fraction of the RAM
+    once every worker process has its own cache.
+
+    Args:
+        image_files: the images read during the export
+        image_size: the size of the thumbnails in meters
+        max_workers: the number of processes reading the images
+
+    Returns:
+        the size of the cache in bytes
+    """
+    size = 0
+    for image_file in image_files:
+        f = dataset_pool.open(image_file)
+
+        # approximate the resolution in meters for the geographic images
+        res = abs(f.res[0]) * (111_320 if f.crs and f.crs.is_geographic else 1)
+        block = max(f.block_shapes[0])
+        side = image_size / res + 2 * block
+        size += side**2 * f.count * np.dtype(f.dtypes[0]).itemsize
+
+    size *= cp.gdal_cache_factor
+
+    ram = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    max_size = ram * cp.gdal_cache_ram_ratio / max(max_workers, 1)
+
+    return int(min(max(size, cp.gdal_cache_min), max_size))
+
+
+def set_gdal_cache(size: int):
+    """Set the size of the GDAL block cache of the current process (in bytes)."""
+
+    gdal.SetCacheMax(size)
 
 
 def reproject(image_path: str, bounds: list) -> np.array:
-    """Reproject the image to 3857 and extract the data in the bounds."""
-    print("########## reproject")
-    print(image_path, bounds)
-
-    with rio.open(image_path) as f:
-        data = f.read(window=from_bounds(*bounds, f.transform))
-
-        # reproject to 3857
-        # I want the final image to be as square not a rectangle
-        src_crs = CRS.from_epsg(4326)
-        dst_crs = CRS.from_epsg(3857)
-        data, _ = warp.reproject(
-            data,
-            src_transform=f.transform,
-            src_crs=src_crs,
-            dst_crs=dst_crs,
-        )
+    """Reproject the image to 3857 and extract the data in the bounds.
+
+    The images already in EPSG:3857 are only read in the window of the bounds.
+    """
+
+    f = dataset_pool.open(image_path)
 
-        # extract all the value separately, matplotlib uses
-        # a different convention
-        return data, warp.transform_bounds(src_crs, dst_crs, *bounds)
+    if f.crs == CRS.from_epsg(3857):
+        bounds = warp.transform_bounds(CRS.from_epsg(4326), f.crs, *bounds)
+        window = from_bounds(*bounds, f.transform).round_offsets().round_lengths()
+        return f.read(window=window), f.window_bounds(window)
 
+    data = f.read(window=from_bounds(*bounds, f.transform))
+
+    # reproject to 3857
+    # I want the final image to be as square not a rectangle
+    src_crs = CRS.from_epsg(4326)
+    dst_crs = CRS.from_epsg(3857)
+    data, _ = warp.reproject(
+        data,
+        src_transform=f.transform,
+        src_crs=src_crs,
+        dst_crs=dst_crs,
+    )
+
+    # extract all the value separately, matplotlib uses
+    # a different convention
+    return data, warp.transform_bounds(src_crs, dst_crs, *bounds)
 
-def get_quad_dict(planet_model, mosaics: list, quad_ids: list) -> dict:
-    """Get a dictionary of quads for each mosaic and quad_id."""
 
-    mosaic_list = planet_model.get_mosaics()
-    quads_dict = {}
+def get_quad_dict(
+    planet_model,
+    mosaics: list,
+    quad_ids: list,
+    max_workers: int = cp.planet_max_workers,
+) -> dict:
+    """Get a dictionary of quads for each mosaic and quad_id.
+
+    The quads of all the mosaics are requested concurrently from a pool of max_workers
+    threads and the descriptions are cached (see planet_api).
+    """
+
+    api_key = planet_api.get_api_key(planet_model)
+    mosaic_list = planet_api.get_mosaics(api_key)
     mosaic_dict = {m["name"]: m for m in mosaic_list}
 
-    for mosaic in mosaics:
-        if mosaic not in mosaic_dict:
-            continue  # Skip if mosaic is not in mosaic_list
+    # Skip the mosaics that are not in mosaic_list
+    mosaic_list = [mosaic_dict[m] for m in mosaics if m in mosaic_dict]
+    quads = planet_api.get_quads(api_key, mosaic_list, quad_ids, max_workers)
+
+    return {
+        mosaic: {quad_id: [quad] for quad_id, quad in mosaic_quads.items()}
+        for mosaic, mosaic_quads in quads.items()
+    }
 
-        for quad_id in quad_ids:
-            if mosaic not in quads_dict:
-                quads_dict[mosaic] = {}
-            if quad_id not in quads_dict[mosaic]:
-                quads_dict[mosaic][quad_id] = []
 
-            quads_dict[mosaic][quad_id].append(
-                planet_model.get_quad(mosaic_dict[mosaic], quad_id)
-            )
+class TokenBucket:
+    """Thread-safe token bucket limiting the rate of the requests sent to a server."""
+
+    def __init__(self, rate: float, capacity: Optional[int] = None):
+        """
+        Args:
+            rate: the number of tokens refilled every second
+            capacity: the maximum number of tokens that can be stored, default to rate
+        """
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and consume it."""
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.last) * self.rate
+                )
+                self.last = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Check if the error is raised by a server refusing too many requests."""
+
+    msg = str(error).lower()
+    return any(m in msg for m in ["too many concurrent", "too many requests", "429"])
+
+
+def call_with_backoff(
+    func: Callable,
+    *args,
+    bucket: Optional[TokenBucket] = None,
+    max_retries: int = 5,
+    backoff: float = 1,
+    retry_on: Callable[[Exception], bool] = is_rate_limit_error,
+    **kwargs,
+):
+    """Call a function and retry it with an exponential backoff if the server refuses too many requests.
+
+    Args:
+        func: the function to call
+        bucket: the token bucket to wait for before each call
+        max_retries: the maximum number of retries
+        backoff: the initial waiting time in seconds, doubled after each retry
+        retry_on: the function checking if an error is worth a retry
+    """
+    for attempt in range(max_retries + 1):
+
+        if bucket:
+            bucket.acquire()
+
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt == max_retries or not retry_on(e):
+                raise
 
-    return quads_dict
+            # add some jitter to avoid synchronized retries between threads
+            time.sleep(backoff * 2**attempt + random.uniform(0, backoff))
 
 
 def remove_tmp_dir(tmp_dir: str):
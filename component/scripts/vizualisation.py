@@ -1,10 +1,9 @@
-import ipyvuetify as v
-import traitlets
-
-
 def set_msg(
     pts, bands_combo, sources, basename, mosaics, image_size, square_size, driver
 ):
+    # loaded here to keep the scripts importable without the display stack
+    import ipyvuetify as v
+    import traitlets
 
     # transform sources in a str
     source_name = " & ".join(sources) if type(sources) == list else None
@@ -23,7 +22,7 @@ def set_msg(
             <p>
             <ul>
                 <li>
-                    <b>{nb_pts}</b> points distributed on <b>{surface:.2f}</b> km\u00B2
+                    <b>{nb_pts}</b> points distributed on <b>{surface:.2f}</b> km\u00b2
                 </li>
                 <li>
                     Using the images coming from <b>{source_name if source_name else driver}</b>
@@ -34,10 +33,10 @@ def set_msg(
                     Using <b>{len(mosaics)}</b> different mosaics
                 </li>
                 <li>
-                    Using thumbnails of <b>{image_size}x{image_size}</b> m\u00B2
+                    Using thumbnails of <b>{image_size}x{image_size}</b> m\u00b2
                 </li>
                 <li>
-                    Displaying squares of <b>{square_size}x{square_size}</b> m\u00B2  
+                    Displaying squares of <b>{square_size}x{square_size}</b> m\u00b2  
                 </li>
                 <li>
                     Saved in a file using <b>{basename}</b> as a basename
@@ -1,4 +1,4 @@
-import tempfile
+import shutil
 from pathlib import Path
 
 import ipywidgets as w
@@ -9,10 +9,12 @@ from traitlets import link
 from wand.color import Color
 from wand.image import Image
 
+from component import parameter as cp
 from component import scripts as cs
 from component import widget as cw
 from component.message import cm
-from component.scripts.utils import get_pdf_path, remove_tmp_dir
+from component.scripts.manifest import JobManifest, get_job_dir
+from component.scripts.utils import get_output_path, remove_tmp_dir
 
 
 class ExportResult(sw.Tile):
@@ -51,12 +53,43 @@ class ExportData(sw.Tile):
             ],
         )
 
+        w_stretch = sw.Select(
+            label="Stretch statistics",
+            items=[{"value": k, "text": v} for k, v in cp.stretch_modes.items()],
+            v_model=ex_model.stretch_mode,
+        )
+
+        w_dpi = sw.Select(
+            label="Resolution (dpi)",
+            items=cp.pdf_dpis,
+            v_model=ex_model.dpi,
+        )
+
+        w_native_crs = sw.Checkbox(
+            label="Download the images in the display projection (EPSG:3857)",
+            v_model=ex_model.native_crs,
+        )
+
+        w_format = sw.Select(
+            label="Output format",
+            items=[{"value": k, "text": v} for k, v in cp.export_formats.items()],
+            v_model=ex_model.output_format,
+        )
+
         super().__init__(
             id_="export_widget",
             title=cm.export.title,
             btn=sw.Btn(cm.export.btn),
             alert=cw.CustomAlert(),
-            inputs=[txt, w_overwrite, w_enhanced],
+            inputs=[
+                txt,
+                w_overwrite,
+                w_native_crs,
+                w_enhanced,
+                w_stretch,
+                w_format,
+                w_dpi,
+            ],
         )
 
         # js behaviour
@@ -64,6 +97,10 @@ class ExportData(sw.Tile):
 
         link((self.ex_model, "overwrite"), (w_overwrite, "v_model"))
         link((self.ex_model, "enhance_method"), (w_enhanced, "v_model"))
+        link((self.ex_model, "dpi"), (w_dpi, "v_model"))
+        link((self.ex_model, "output_format"), (w_format, "v_model"))
+        link((self.ex_model, "native_crs"), (w_native_crs, "v_model"))
+        link((self.ex_model, "stretch_mode"), (w_stretch, "v_model"))
 
     @su.loading_button()
     def _export_data(self, widget, event, data):
@@ -80,17 +117,42 @@ class ExportData(sw.Tile):
         image_size = self.viz_model.image_size
         mosaics = self.viz_model.mosaics
         enhance_method = self.ex_model.enhance_method
+        dpi = self.ex_model.dpi
+        output_format = self.ex_model.output_format
+        native_crs = self.ex_model.native_crs
+        stretch_mode = self.ex_model.stretch_mode
 
-        tmp_dir = Path(tempfile.mkdtemp())
-        pdf_filepath = get_pdf_path(
-            file.stem, sources, bands, image_size, enhance_method
+        output_path = get_output_path(
+            file.stem, sources, bands, image_size, enhance_method, output_format
         )
 
-        try:
+        if output_path.exists() and not self.ex_model.overwrite:
+            self.alert.add_live_msg("Output already exist", "success")
+            return
+
+        # use a durable folder to resume the job if it was interrupted
+        job_params = {
+            "file": str(file),
+            "driver": self.viz_model.driver,
+            "geometry": geometry.to_json(),
+            "bands": bands,
+            "sources": sources,
+            "square_size": square_size,
+            "image_size": image_size,
+            "mosaics": mosaics,
+            "enhance_method": enhance_method,
+            "dpi": dpi,
+            "output_format": output_format,
+            "native_crs": native_crs,
+            "stretch_mode": stretch_mode,
+        }
+        tmp_dir = get_job_dir(job_params)
+        manifest = JobManifest(tmp_dir)
 
-            if pdf_filepath.is_file() and not self.ex_model.overwrite:
-                self.alert.add_live_msg("Pdf already exist", "success")
-                return
+        if manifest.tasks:
+            self.alert.add_live_msg("Resuming the previous export of these points")
+
+        try:
 
             # create the vrt from gee images
             if self.viz_model.driver == "planet":
@@ -103,6 +165,8 @@ class ExportData(sw.Tile):
                     self.alert,
                     tmp_dir,
                     self.planet_model,
+                    manifest,
+                    native_crs,
                 )
 
             elif self.viz_model.driver == "gee":
@@ -115,45 +179,85 @@ class ExportData(sw.Tile):
                     sources,
                     self.alert,
                     tmp_dir,
+                    manifest,
+                    native_crs,
                 )
 
             # export as pdf
-            pdf_file = cs.get_pdf(
-                file,
-                mosaics,
-                image_size,
-                square_size,
-                vrt_list,
-                title_list,
-                bands,
-                geometry,
-                self.alert,
-                tmp_dir,
-                enhance_method,
-                sources,
-            )
-
-            # create a download btn
-            dwn = sw.DownloadBtn(cm.export.down_btn, path=str(pdf_file))
-
-            # create a preview of the first page
-            pdf_file = str(pdf_file)
-            preview = pdf_file.replace(".pdf", "_preview.png")
-
-            with Image(filename=f"{pdf_file}[0]") as img:
-                img.background_color = Color("white")
-                img.alpha_channel = "remove"
-                img.save(filename=preview)
-
-            img_widget = w.Image(value=open(preview, "rb").read())
-
-            self.result_tile.set_content([dwn, img_widget])
+            if output_format == "pdf":
+                pdf_file = cs.get_pdf(
+                    file,
+                    mosaics,
+                    image_size,
+                    square_size,
+                    vrt_list,
+                    title_list,
+                    bands,
+                    geometry,
+                    self.alert,
+                    tmp_dir,
+                    enhance_method,
+                    sources,
+                    manifest,
+                    dpi=dpi,
+                    stretch_mode=stretch_mode,
+                )
+
+                # create a download btn
+                dwn = sw.DownloadBtn(cm.export.down_btn, path=str(pdf_file))
+
+                # create a preview of the first page
+                pdf_file = str(pdf_file)
+                preview = pdf_file.replace(".pdf", "_preview.png")
+
+                with Image(filename=f"{pdf_file}[0]") as img:
+                    img.background_color = Color("white")
+                    img.alpha_channel = "remove"
+                    img.save(filename=preview)
+
+                img_widget = w.Image(value=open(preview, "rb").read())
+
+                self.result_tile.set_content([dwn, img_widget])
+
+            # export one file per point
+            else:
+                folder = cs.get_images(
+                    file,
+                    mosaics,
+                    image_size,
+                    square_size,
+                    vrt_list,
+                    title_list,
+                    bands,
+                    geometry,
+                    self.alert,
+                    tmp_dir,
+                    enhance_method,
+                    sources,
+                    manifest,
+                    format=output_format,
+                    stretch_mode=stretch_mode,
+                )
+
+                # the folder is zipped to be downloaded in a single file
+                archive = shutil.make_archive(str(folder), "zip", folder)
+                dwn = sw.DownloadBtn(cm.export.down_btn, path=archive)
+
+                content = [dwn]
+                if output_format != "cog":
+                    preview = next(folder.glob(f"*.{output_format}"), None)
+                    if preview is None:
+                        self.alert.add_msg(cm.export.no_image, "warning")
+                    else:
+                        content.append(w.Image(value=preview.read_bytes()))
+
+                self.result_tile.set_content(content)
 
         except Exception as e:
+            # keep the job folder to resume the export in the next run
             raise e
 
-        finally:
-            # remove the temporary folder in any case
-            remove_tmp_dir(tmp_dir)
+        # the job folder is only needed to resume an interrupted export
+        remove_tmp_dir(tmp_dir)
 
         return
@@ -0,0 +1,51 @@
+import os
+
+from component.scripts.cache import TileCache, get_cache_key, get_geometry_hash
+
+
+def test_get_cache_key():
+
+    assert get_cache_key("gee", "landsat_8", 2020) == get_cache_key(
+        "gee", "landsat_8", 2020
+    )
+    assert get_cache_key("gee", "landsat_8", 2020) != get_cache_key(
+        "gee", "landsat_8", 2021
+    )
+
+    # float noise doesn't change the geometry hash
+    geometry = {"type": "Polygon", "coordinates": [[[13.0245131, 5.3335728]]]}
+    noisy = {"type": "Polygon", "coordinates": [[[13.02451310000001, 5.3335728]]]}
+    assert get_geometry_hash(geometry) == get_geometry_hash(noisy)
+
+
+def test_tile_cache(tmp_path):
+
+    cache = TileCache(tmp_path / "cache", max_size=25)
+
+    src = tmp_path / "src.tif"
+    src.write_bytes(b"0" * 10)
+
+    # missing tiles are not found
+    assert cache.get("a" * 64, tmp_path / "dst.tif") is False
+
+    # cached tiles are copied to the destination
+    cache.put("a" * 64, src)
+    assert cache.get("a" * 64, tmp_path / "dst.tif") is True
+    assert (tmp_path / "dst.tif").read_bytes() == src.read_bytes()
+
+    # replacing a tile only counts its new size
+    cache.put("a" * 64, src)
+    assert cache.size == 10
+
+    # the least recently used tile is evicted when the cache is full
+    cache.put("b" * 64, src)
+    os.utime(cache.path("a" * 64), (0, 0))
+    cache.put("c" * 64, src)
+    assert not cache.path("a" * 64).is_file()
+    assert cache.path("b" * 64).is_file()
+    assert cache.path("c" * 64).is_file()
+
+    # a disabled cache never stores anything
+    cache = TileCache(tmp_path / "disabled", max_size=0)
+    cache.put("a" * 64, src)
+    assert cache.get("a" * 64, tmp_path / "other.tif") is False
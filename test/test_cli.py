@@ -0,0 +1,67 @@
+import io
+
+import pytest
+
+from component import parameter as cp
+from component import scripts as cs
+from component.cli import TextProgress, check_args, get_parser, run
+
+
+def test_check_args(tmp_path):
+
+    file = tmp_path / "points.csv"
+    file.write_text("id,lat,lng\n1,5.3,13.0\n")
+
+    parser = get_parser()
+    args = parser.parse_args(
+        [str(file), "--mosaics", "2020", "2021", "--bands", "Red, Green, Blue"]
+    )
+    check_args(parser, args)
+    assert args.mosaics == [2020, 2021]
+
+    # wrong inputs exit with the argparse error code
+    args = parser.parse_args([str(file), "--mosaics", "2020", "--bands", "rgb"])
+    with pytest.raises(SystemExit) as e:
+        check_args(parser, args)
+    assert e.value.code == 2
+
+
+def test_text_progress():
+
+    stream = io.StringIO()
+    output = TextProgress(stream, interval=3600)
+    output.reset_progress(3, "Downloading")
+    for _ in range(3):
+        output.update_progress()
+
+    lines = stream.getvalue().splitlines()
+    assert lines[0] == "Downloading 0/3"
+    assert lines[-1] == "Downloading 3/3"
+
+
+def test_run_job_dir(tmp_path, monkeypatch):
+
+    file = tmp_path / "points.csv"
+    file.write_text("id,lat,lng\n1,5.3,13.0\n")
+    parser = get_parser()
+    args = parser.parse_args(
+        [str(file), "--mosaics", "2020", "--bands", "Red, Green, Blue", "--overwrite"]
+    )
+    check_args(parser, args)
+
+    # the pipeline is replaced by functions recording the job folder
+    job_dirs = []
+    monkeypatch.setattr(cp, "job_dir", tmp_path / "jobs")
+    monkeypatch.setattr(cs, "get_gee_vrt", lambda *a: job_dirs.append(a[7]) or ({}, {}))
+    monkeypatch.setattr(cs, "get_pdf", lambda *a, **k: tmp_path / "out.pdf")
+    (tmp_path / "jobs").mkdir()
+
+    # the job folder is removed once the output is written
+    assert run(args, TextProgress(io.StringIO())) == tmp_path / "out.pdf"
+    assert not job_dirs[-1].exists()
+
+    # and kept when the export fails to resume it
+    monkeypatch.setattr(cs, "get_pdf", lambda *a, **k: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        run(args, TextProgress(io.StringIO()))
+    assert job_dirs[-1].is_dir()
@@ -1,7 +1,13 @@
 import tempfile
 from pathlib import Path
 
-from component.scripts.export import get_pdf
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.transform import from_bounds
+
+from component import parameter as cp
+from component.scripts.export import get_images, get_pages, get_pdf, split_pages
 from component.scripts.gee import get_gee_vrt
 from component.scripts.planet import get_planet_vrt
 from component.scripts.utils import remove_tmp_dir
@@ -97,3 +103,113 @@ def test_get_planet_pdf(geometries, alert, planet_model):
         raise e
     finally:
         remove_tmp_dir(tmp_dir)
+
+
+@pytest.mark.parametrize("format", ["png", "cog"])
+def test_get_gee_images(geometries, alert, format):
+
+    try:
+        tmp_dir = Path(tempfile.mkdtemp())
+        input_file_path = tmp_dir / "test_points.csv"
+        mosaics = [2023, 2024]
+        image_size = 10000
+        sources = ["landsat"]
+        bands = "Red, Green, Blue"
+        square_size = 90
+
+        vrt_list, title_list = get_gee_vrt(
+            geometries,
+            mosaics,
+            image_size,
+            input_file_path.stem,
+            bands,
+            sources,
+            alert,
+            tmp_dir,
+        )
+
+        folder = get_images(
+            input_file_path=input_file_path,
+            mosaics=mosaics,
+            image_size=image_size,
+            square_size=square_size,
+            vrt_list=vrt_list,
+            title_list=title_list,
+            band_combo=bands,
+            geometry=geometries,
+            output=alert,
+            tmp_dir=tmp_dir,
+            sources=sources,
+            format=format,
+        )
+
+        extension = "tif" if format == "cog" else format
+        assert len(list(folder.glob(f"*.{extension}"))) == len(geometries)
+
+    except Exception as e:
+        raise e
+    finally:
+        remove_tmp_dir(tmp_dir)
+
+
+def test_get_planet_cog(geometries, alert, tmp_path):
+
+    # a 3 bands mosaic in the native projection of the Planet quads
+    mosaic = "planet_medres_normalized_analytic_2020-10_mosaic"
+    minx, miny, maxx, maxy = geometries.to_crs(3857).total_bounds
+    bounds = (minx - 5000, miny - 5000, maxx + 5000, maxy + 5000)
+    vrt = tmp_path / f"{mosaic}.tif"
+    profile = {"driver": "GTiff", "count": 3, "dtype": "uint16", "crs": "EPSG:3857"}
+    transform = from_bounds(*bounds, 500, 500)
+    with rio.open(vrt, "w", width=500, height=500, transform=transform, **profile) as f:
+        f.write(np.random.randint(0, 3000, (3, 500, 500), dtype=np.uint16))
+
+    folder = get_images(
+        input_file_path=tmp_path / "test_points.csv",
+        mosaics=[mosaic],
+        image_size=2000,
+        square_size=90,
+        vrt_list={mosaic: vrt},
+        title_list={mosaic: {i: "2020-10" for i in geometries.index}},
+        band_combo="rgb",
+        geometry=geometries,
+        output=alert,
+        tmp_dir=tmp_path,
+        sources=["planet"],
+        format="cog",
+    )
+
+    files = list(folder.glob("*.tif"))
+    assert len(files) == len(geometries)
+    with rio.open(files[0]) as f:
+        assert f.descriptions == tuple(
+            f"{mosaic}_{b}" for b in ["Red", "Green", "Blue"]
+        )
+
+
+def test_get_pages_duplicated_ids(geometries):
+
+    # ids that are duplicated or sanitized to the same name
+    geometries = geometries.assign(id=["a", "a", "a b", "a_b", "c"])
+    mosaics = [2024]
+    vrt_list = {2024: "2024.vrt"}
+    title_list = {2024: {i: "2024 L8" for i in geometries.index}}
+
+    pages = get_pages(geometries, mosaics, 2000, 90, vrt_list, title_list, "min_max")
+
+    # every point keeps its page, in the order of the points
+    assert list(pages) == ["a", "a_1", "a_b", "a_b_3", "c"]
+
+
+def test_split_pages():
+
+    pages = {str(i): {} for i in range(10_000)}
+
+    # large exports use larger parts to keep a bounded number of parts
+    parts = split_pages(pages)
+    assert len(parts) == cp.pdf_max_parts
+    assert [n for _, _, part in parts for n in part] == list(pages)
+
+    # small exports keep parts of cp.pdf_pages_per_part points
+    parts = split_pages(dict(list(pages.items())[:120]))
+    assert [end - start for start, end, _ in parts] == [50, 50, 20]
@@ -2,6 +2,7 @@ import os
 import sys
 
 import ee
+import numpy as np
 import pytest
 import rasterio
 
@@ -16,9 +17,11 @@ from test.gee_results import *
 from component import parameter as cp
 from component.scripts.gee import (
     download_image,
+    get_clusters,
     get_ee_image,
     get_ee_tasks,
     get_gee_vrt,
+    get_grid_latitude,
 )
 
 # Test different parameters
@@ -223,3 +226,37 @@ def test_download_image(alert):
         array = src.read()
         assert array.shape[0] == 1
         assert src.meta["driver"] == "GTiff"
+
+
+def test_get_grid_latitude():
+
+    north = ee.Geometry.Polygon([[[13, 45.1], [13, 45], [13.1, 45], [13, 45.1]]])
+    south = ee.Geometry.Polygon([[[13, -5.3], [13, -5.4], [13.1, -5.4], [13, -5.3]]])
+    equator = ee.Geometry.Polygon([[[13, 0.1], [13, -0.1], [13.1, -0.1], [13, 0.1]]])
+
+    assert get_grid_latitude([north, south]) == 5.3
+    assert get_grid_latitude([north, equator]) == 0
+
+
+def test_get_clusters():
+
+    # 3 overlapping buffers, a far one and one using another satellite
+    side = 2000
+    centers = [(0, 0), (500, 500), (-500, 800), (50_000, 0), (20_000, 0)]
+    bounds = np.array([[x, y, x + side, y + side] for x, y in centers], dtype=float)
+    satellites = ["landsat_8"] * 4 + ["sentinel_2"]
+
+    clusters = get_clusters(bounds, satellites)
+
+    assert clusters == [[0, 1, 2], [3], [4]]
+
+    # groups covering a buffer that is not one of their members are not kept
+    bounds[4] = [0, 100, side, 100 + side]
+    assert get_clusters(bounds, satellites) == [[0], [1], [2], [3], [4]]
+
+    # the regions are never larger than the pixel budget
+    clusters = get_clusters(bounds, satellites, max_pixels=70)
+    assert all(len(c) == 1 for c in clusters)
+
+    # groups larger than their buffers are not kept
+    assert get_clusters(bounds[[0, 1]], satellites[:2], max_ratio=0.5) == [[0], [1]]
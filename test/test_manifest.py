@@ -0,0 +1,34 @@
+from component.scripts.manifest import (
+    DOWNLOADED,
+    PENDING,
+    RENDERED,
+    JobManifest,
+)
+
+
+def test_job_manifest(tmp_path):
+
+    manifest = JobManifest(tmp_path)
+    manifest.set_status("gee/2020/0", PENDING, satellite="landsat_8")
+    manifest.set_status("gee/2020/0", DOWNLOADED)
+    manifest.set_status("pdf/1", RENDERED)
+
+    # the information of a task are kept between status updates
+    assert manifest.get("gee/2020/0") == {
+        "satellite": "landsat_8",
+        "status": DOWNLOADED,
+    }
+
+    # a truncated last line doesn't prevent the job from being resumed
+    with manifest.path.open("a") as f:
+        f.write('{"key": "pdf/2", "sta')
+
+    resumed = JobManifest(tmp_path)
+    assert resumed.status("gee/2020/0") == DOWNLOADED
+    assert resumed.get("gee/2020/0")["satellite"] == "landsat_8"
+    assert resumed.status("pdf/1") == RENDERED
+    assert resumed.status("pdf/2") is None
+
+    # new entries are not lost after a truncated line
+    resumed.set_status("pdf/2", RENDERED)
+    assert JobManifest(tmp_path).status("pdf/2") == RENDERED
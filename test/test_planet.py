@@ -2,19 +2,35 @@ import os
 import sys
 
 import pytest
+import requests
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 import tempfile
 from pathlib import Path
-from test.planet_results import *
 
-from component.scripts.planet import get_planet_grid, get_planet_vrt, get_quad
+from component.scripts.planet import (
+    IncompleteDownloadError,
+    get_planet_grid,
+    get_planet_vrt,
+    get_quad,
+    get_quad_bounds,
+    get_quad_ids,
+    is_transient_error,
+    plan_quads,
+)
+from component.scripts.planet_api import (
+    MetadataCache,
+    describe_quad,
+    get_api_key,
+    get_session,
+)
 from component.scripts.utils import (
     get_buffers,
     get_quad_dict,
     remove_tmp_dir,
 )
+from test.planet_results import *
 
 # Test different parameters
 parameters = [
@@ -89,6 +105,35 @@ def test_get_planet_grid(geometries, alert):
     assert quad_id_2 == "1098-1054"
 
 
+def test_plan_quads(geometries, alert):
+
+    buffers = get_buffers(gdf=geometries, size=250).geometry
+    grid = get_planet_grid(squares=buffers, out=alert)
+
+    quad_ids, counts = plan_quads(buffers, grid)
+
+    # each quad is planned once but counted for every buffer that needs it
+    assert sorted(quad_ids) == ["1097-1055", "1098-1054"]
+    assert set(counts) == set(quad_ids)
+    assert sum(counts.values()) >= len(buffers)
+
+
+def test_get_quad_bounds(geometries, alert):
+
+    buffers = get_buffers(gdf=geometries, size=250).geometry
+    grid = get_planet_grid(squares=buffers, out=alert)
+
+    quad_bounds = get_quad_bounds(buffers, grid)
+
+    # each quad only keeps the extent of the buffers it contains
+    assert sorted(quad_bounds) == ["1097-1055", "1098-1054"]
+    for quad_id, (minx, miny, maxx, maxy) in quad_bounds.items():
+        inside = buffers[
+            buffers.intersects(grid.geometry[get_quad_ids(grid) == quad_id].iloc[0])
+        ]
+        assert (minx, miny, maxx, maxy) == tuple(inside.total_bounds)
+
+
 def test_get_planet_quad(planet_model, alert):
     """Test the get_ee_image function."""
 
@@ -109,18 +154,16 @@ def test_get_planet_quad(planet_model, alert):
         mosaic_quads = quads_dict[mosaic_name]
 
         bands = "rgb"  # or cir
-        file_list = []
 
         quad = get_quad(
-            quad_ids[0],
-            filename,
-            mosaic_quads,
-            mosaic_name,
-            bands,
-            file_list,
-            alert,
-            None,
-            tmp_dir,
+            quad_id=quad_ids[0],
+            filename=filename,
+            mosaic_quads=mosaic_quads,
+            mosaic_name=mosaic_name,
+            bands=bands,
+            out=alert,
+            session=get_session(get_api_key(planet_model)),
+            tmp_dir=tmp_dir,
         )
 
         assert (
@@ -132,3 +175,68 @@ def test_get_planet_quad(planet_model, alert):
         raise e
     finally:
         remove_tmp_dir(tmp_dir)
+
+
+def test_metadata_cache(tmp_path):
+
+    cache = MetadataCache(tmp_path, ttl=60)
+    quad = {"id": "1097-1055", "_links": {"download": "url"}}
+
+    assert cache.get("abc") is None
+
+    # empty responses (missing quads) are cached as well
+    cache.put("abc", quad)
+    cache.put("def", {})
+    assert cache.get("abc") == quad
+    assert cache.get("def") == {}
+
+    # expired responses are ignored
+    cache.ttl = 1e-6
+    assert cache.get("abc") is None
+
+    # a ttl of 0 disables the cache
+    cache = MetadataCache(tmp_path / "disabled", ttl=0)
+    cache.put("abc", quad)
+    assert cache.get("abc") is None
+    assert not (tmp_path / "disabled").exists()
+
+
+def test_describe_quad(tmp_path):
+
+    url = "https://link.planet.com/basemaps/v1/mosaics/m/quads/q/full"
+    quad = {
+        "id": "1097-1055",
+        "bbox": [13.0, 5.3, 13.1, 5.4],
+        "percent_covered": 100,
+        "_links": {
+            "_self": f"{url[:-5]}?api_key=secret",
+            "download": f"{url}?api_key=secret&format=tif",
+        },
+    }
+
+    # only the used fields are kept and the API key is removed from the links
+    description = describe_quad(quad)
+    assert description == {
+        "id": "1097-1055",
+        "bbox": [13.0, 5.3, 13.1, 5.4],
+        "_links": {"download": f"{url}?format=tif"},
+    }
+    assert describe_quad({}) == {}
+
+    # the cached descriptions are only readable by the user
+    cache = MetadataCache(tmp_path, ttl=60)
+    cache.put("abc", description)
+    assert cache.path("abc").stat().st_mode & 0o777 == 0o600
+
+
+def test_is_transient_error():
+
+    # the connection problems and rate limits are retried
+    assert is_transient_error(requests.ConnectionError("reset by peer"))
+    assert is_transient_error(requests.exceptions.ReadTimeout())
+    assert is_transient_error(IncompleteDownloadError("ended after 10 bytes"))
+    assert is_transient_error(requests.HTTPError("429 Client Error: Too Many Requests"))
+
+    # the other errors are raised at once
+    assert not is_transient_error(requests.HTTPError("403 Client Error: Forbidden"))
+    assert not is_transient_error(ValueError("invalid quad"))
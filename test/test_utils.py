@@ -2,7 +2,12 @@ import os
 import sys
 
 import ee
+import geopandas as gpd
+import numpy as np
+import pytest
 import rasterio
+from shapely.geometry import Point
+from skimage import exposure
 
 from component.scripts.gee import download_image, get_ee_tasks
 
@@ -11,7 +16,14 @@ import tempfile
 from pathlib import Path
 from test.gee_results import *
 
-from component.scripts.utils import enhance_band
+from component.scripts.utils import (
+    StretchAccumulator,
+    enhance_band,
+    enhance_bands,
+    equalize_adapthist,
+    equalize_hist,
+    get_buffers,
+)
 
 
 def test_enhance_band(alert):
@@ -68,3 +80,129 @@ def test_enhance_band(alert):
             assert enhanced.dtype == data.dtype
             assert enhanced.max() <= 1
             assert enhanced.min() >= 0
+
+
+@pytest.mark.parametrize(
+    "method",
+    [
+        "histogram_equalization",
+        "contrast_stretching",
+        "standard_deviation",
+        "percent_clip",
+        "min_max",
+    ],
+)
+def test_enhance_bands(method):
+
+    rng = np.random.default_rng(0)
+    data = rng.gamma(2, 500, (3, 100, 100)).astype("uint16")
+
+    expected = np.stack([enhance_band(b, method) for b in data])
+    enhanced = enhance_bands(data, method)
+
+    assert enhanced.dtype == np.float32
+    assert np.allclose(enhanced, expected, atol=1e-4)
+
+    # a stack of images gives the same result as each image
+    stack = np.stack([data, data[::-1]])
+    assert np.allclose(enhance_bands(stack, method)[0], enhanced)
+
+    # nan are replaced by the minimum of the band
+    data = data.astype("float32")
+    data[0, :5, :5] = np.nan
+    enhanced = enhance_bands(data, method)
+    assert not np.isnan(enhanced).any()
+    assert enhanced.min() >= 0 and enhanced.max() <= 1
+
+
+@pytest.mark.parametrize(
+    "dtype, scale, offset",
+    [("uint16", 500, 0), ("int16", 5000, -30000), ("float32", 0.05, 0)],
+)
+def test_equalize_hist(dtype, scale, offset):
+
+    rng = np.random.default_rng(0)
+    band = (rng.gamma(2, scale, (100, 100)) + offset).clip(-30000, 30000).astype(dtype)
+
+    # compare with the histogram based equalization of skimage
+    expected = exposure.equalize_hist(band, nbins=3000)
+    expected = (expected - expected.min()) / (expected.max() - expected.min())
+
+    equalized = equalize_hist(band)
+
+    assert equalized.dtype == np.float32
+    assert equalized.shape == band.shape
+    assert np.allclose(equalized, expected, atol=2e-3)
+
+
+def test_equalize_adapthist():
+
+    pytest.importorskip("cv2")
+
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:300, 0:300]
+    band = rng.gamma(2, 0.05, (300, 300)) + np.sin(x / 50) * np.cos(y / 75)
+    band = ((band - band.min()) / (band.max() - band.min())).astype(np.float32)
+
+    expected = equalize_adapthist(band, "skimage")
+    equalized = equalize_adapthist(band, "opencv")
+
+    # the implementations differ on the tile borders but give the same image
+    assert equalized.shape == band.shape
+    assert np.abs(equalized - expected).mean() < 0.05
+
+
+@pytest.mark.parametrize("method", ["min_max", "percent_clip"])
+def test_stretch_accumulator(method):
+
+    rng = np.random.default_rng(0)
+    stack = [rng.gamma(2, 500 * (i + 1), (3, 100, 100)) for i in range(4)]
+    stack[0][0, :5, :5] = np.nan
+
+    accumulator = StretchAccumulator(sample_size=10_000)
+    for data in stack:
+        accumulator.update(data)
+    low, high = accumulator.limits(method)
+
+    # the limits are the ones of the full stack (the percentiles from a sample)
+    full = np.stack(stack)
+    if method == "min_max":
+        expected = np.nanmin(full, axis=(0, 2, 3)), np.nanmax(full, axis=(0, 2, 3))
+        rtol = 1e-6
+    else:
+        expected = np.nanpercentile(full, [1, 99], axis=(0, 2, 3))
+        rtol = 0.1
+    assert low.shape == (3, 1, 1)
+    assert np.allclose(low.ravel(), expected[0], rtol=rtol)
+    assert np.allclose(high.ravel(), expected[1], rtol=rtol)
+
+    # the same limits are applied to every year
+    enhanced = [enhance_bands(data, method, (low, high)) for data in stack]
+    assert all(e.min() >= 0 and e.max() <= 1 for e in enhanced)
+    assert enhanced[0].mean() < enhanced[-1].mean()
+
+    # nan are displayed as the low limit, like without shared limits
+    assert (enhanced[0][0, :5, :5] == 0).all()
+
+
+def test_get_buffers():
+
+    geoms = [Point(13.0, 5.0), Point(13.1, 5.1).buffer(0.05)]
+    gdf = gpd.GeoDataFrame({"id": ["a", "a"]}, geometry=geoms, crs=4326)
+
+    buffers = get_buffers(gdf, 2000)
+
+    # duplicated ids and the columns of the input are kept
+    assert list(buffers.id) == ["a", "a"]
+    assert buffers.crs.to_epsg() == 4326
+
+    # the squares are at least the requested size, larger for big shapes
+    squares = buffers.to_crs(3857).geometry
+    minx, miny, maxx, maxy = squares.iloc[0].bounds
+    assert maxx - minx == pytest.approx(2000)
+    assert maxy - miny == pytest.approx(2000)
+    assert squares.iloc[1].contains(gdf.to_crs(3857).geometry.iloc[1])
+
+    # the result is memoized but cannot be modified by the caller
+    buffers["id"] = "b"
+    assert list(get_buffers(gdf, 2000).id) == ["a", "a"]